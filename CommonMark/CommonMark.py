@@ -13,6 +13,7 @@ import json
 from builtins import str
 from CommonMark.blocks import Parser
 from CommonMark.html import HtmlRenderer
+from CommonMark.node import Node
 
 
 # Utility functions
@@ -40,31 +41,29 @@ def commonmark(text, format="html"):
 
 
 def prepare(block):
-    """ Strips circular 'parent' references and trims empty
-    block elements."""
+    """ Returns the attributes of block as a dict, without the
+    circular 'parent' and sibling references and with empty
+    elements trimmed."""
     to_remove = [
-        'parent', 'nxt', 'prv', 'first_child', 'last_child',
+        'type_code', 'parent', 'nxt', 'prv', 'first_child', 'last_child',
     ]
-    for r in to_remove:
-        block.__dict__[r] = None
-    if block.is_open is not None:
-        block.__dict__['open'] = block.is_open
-        del(block.is_open)
-    # trim empty elements...
-    for attr in dir(block):
-        if not callable(attr) and not attr.startswith("__") and \
-           attr not in ['pretty', 'is_container',
-                        'append_child', 'prepend_child', 'unlink',
-                        'insert_after', 'insert_before', 'walker']:
-            if block.__dict__[attr] in ["", [], None, {}]:
-                del(block.__dict__[attr])
-    return block
+    data = {'t': block.t}
+    for attr in Node.__slots__:
+        if attr in to_remove:
+            continue
+        value = getattr(block, attr)
+        # trim empty elements...
+        if value in ["", [], None, {}]:
+            continue
+        data['open' if attr == 'is_open' else attr] = value
+    return data
 
 
 def ASTtoJSON(block):
-    """ Output AST in JSON form, this is destructive of block."""
+    """ Output AST in JSON form."""
     # sort_keys=True) # indent=4)
-    return json.dumps(prepare(block), default=lambda o: o.__dict__)
+    return json.dumps(prepare(block), default=lambda o: dict(
+        (attr, getattr(o, attr)) for attr in o.__slots__))
 
 
 def dumpAST(obj, ind=0, topnode=False):
@@ -90,31 +89,28 @@ def dumpAST(obj, ind=0, topnode=False):
         print("\t" + indChar + "Info: " + (obj.info or ''))
     if not obj.literal == "":
         print("\t" + indChar + "Literal: " + (obj.literal or ''))
-    if obj.list_data.get('type'):
+    if obj.list_data is not None and obj.list_data.type:
         print("\t" + indChar + "List Data: ")
-        print("\t\t" + indChar + "[type] = " + obj.list_data.get('type'))
-        if obj.list_data.get('bullet_char'):
+        print("\t\t" + indChar + "[type] = " + obj.list_data.type)
+        if obj.list_data.bullet_char:
             print(
                 "\t\t" + indChar + "[bullet_char] = " +
-                obj.list_data['bullet_char'])
-        if obj.list_data.get('start'):
-            print("\t\t" + indChar + "[start] = " + obj.list_data.get('start'))
-        if obj.list_data.get('delimiter'):
+                obj.list_data.bullet_char)
+        if obj.list_data.start:
+            print("\t\t" + indChar + "[start] = " + str(obj.list_data.start))
+        if obj.list_data.delimiter:
             print(
                 "\t\t" + indChar + "[delimiter] = " +
-                obj.list_data.get('delimiter'))
-        if obj.list_data.get('padding'):
+                obj.list_data.delimiter)
+        if obj.list_data.padding:
             print(
                 "\t\t" + indChar + "[padding] = " +
-                str(obj.list_data.get('padding')))
-        if obj.list_data.get('marker_offset'):
+                str(obj.list_data.padding))
+        if obj.list_data.marker_offset:
             print(
                 "\t\t" + indChar + "[marker_offset] = " +
-                str(obj.list_data.get('marker_offset')))
-    if obj.walker:
-        print("\t" + indChar + "Children:")
-        walker = obj.walker()
-        nxt = walker.nxt()
-        while nxt is not None and topnode is False:
-            dumpAST(nxt['node'], ind + 2, topnode=True)
-            nxt = walker.nxt()
+                str(obj.list_data.marker_offset))
+    print("\t" + indChar + "Children:")
+    if not topnode:
+        for node, entering in obj.walk():
+            dumpAST(node, ind + 2, topnode=True)
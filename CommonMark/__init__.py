@@ -4,4 +4,7 @@ from CommonMark.CommonMark import Parser
 from CommonMark.CommonMark import dumpAST
 from CommonMark.CommonMark import ASTtoJSON
 from CommonMark.CommonMark import commonmark
-__all__ = ["HtmlRenderer", "Parser", "dumpAST", "ASTtoJSON", "commonmark"]
+from CommonMark.node import text_content
+from CommonMark.arraytree import ArrayTree
+__all__ = ["HtmlRenderer", "Parser", "dumpAST", "ASTtoJSON", "commonmark",
+           "text_content", "ArrayTree"]
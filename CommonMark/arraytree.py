@@ -0,0 +1,344 @@
+"""
+A compact, array-backed copy of a parsed document, for keeping very
+large documents in memory once they have been parsed.  The copy is
+made from the Node tree that the parser builds, so it lowers the
+memory a document holds afterwards, not the peak memory used while
+parsing it.
+
+An ArrayTree stores the type, parent, first child, next sibling,
+sourcepos and flags of each node in array columns, indexed by the
+node's position in the document, and the literals of all nodes in one
+string.  The few attributes that only some blocks have (list_data,
+destination, info, level and so on) are kept in dicts by index.
+ArrayNode is a read-only, Node-like view of one node of the tree, which
+can be walked and rendered like a Node:
+
+    tree = ArrayTree(Parser().parse(text))
+    html = HtmlRenderer().render(tree.root)
+"""
+from __future__ import absolute_import, unicode_literals
+
+from array import array
+
+from CommonMark.node import CONTAINER_CODES, NODE_TYPES, Node
+
+# str() for Python 2, where array() does not take unicode type codes
+TYPE_CODE = str('i')
+FLAGS = str('B')
+INDEX = str('i')
+
+IS_OPEN = 1
+LAST_LINE_BLANK = 2
+IS_FENCED = 4
+
+# The attributes that are not in a column, with the value a new Node has
+_blank = Node('Document', None)
+ATTRIBUTE_DEFAULTS = dict(
+    (attr, getattr(_blank, attr)) for attr in Node.__slots__
+    if attr not in (
+        'type_code', 'parent', 'first_child', 'last_child', 'prv', 'nxt',
+        'sourcepos', 'literal', 'is_open', 'last_line_blank', 'is_fenced'))
+del _blank
+
+
+class ArrayTree(object):
+    """
+    An array-backed copy of the tree under root, which is usually a
+    parsed Document.  Nodes are numbered in document order, root first,
+    and -1 stands for no node in the parents, first_children and
+    next_siblings columns.  sourcepos holds four numbers per node, all
+    0 when the node has no sourcepos, and literal_starts and
+    literal_ends the slice of text that is the node's literal, with a
+    start of -1 when it has none.  attributes maps the name of each
+    other Node attribute to a dict of the nodes where it is set, by
+    index.
+    """
+
+    def __init__(self, root):
+        self.types = types = array(TYPE_CODE)
+        self.parents = parents = array(INDEX)
+        self.first_children = first_children = array(INDEX)
+        self.next_siblings = next_siblings = array(INDEX)
+        self.sourcepos = sourcepos = array(INDEX)
+        self.flags = flags = array(FLAGS)
+        self.literal_starts = literal_starts = array(INDEX)
+        self.literal_ends = literal_ends = array(INDEX)
+        self.attributes = attributes = dict(
+            (attr, {}) for attr in ATTRIBUTE_DEFAULTS)
+        literals = []
+        length = 0
+        # [index, index of the last child so far] of each open container
+        stack = []
+
+        for node, entering in root.walk():
+            if not entering:
+                stack.pop()
+                continue
+            index = len(types)
+
+            types.append(node.type_code)
+
+            if stack:
+                top = stack[-1]
+                parents.append(top[0])
+                if top[1] == -1:
+                    first_children[top[0]] = index
+                else:
+                    next_siblings[top[1]] = index
+                top[1] = index
+            else:
+                parents.append(-1)
+            first_children.append(-1)
+            next_siblings.append(-1)
+
+            pos = node.sourcepos
+            if pos:
+                sourcepos.extend((pos[0][0], pos[0][1], pos[1][0], pos[1][1]))
+            else:
+                sourcepos.extend((0, 0, 0, 0))
+
+            flags.append(
+                (IS_OPEN if node.is_open else 0) |
+                (LAST_LINE_BLANK if node.last_line_blank else 0) |
+                (IS_FENCED if node.is_fenced else 0))
+
+            literal = node.literal
+            if literal is None:
+                literal_starts.append(-1)
+                literal_ends.append(-1)
+            else:
+                literals.append(literal)
+                literal_starts.append(length)
+                length += len(literal)
+                literal_ends.append(length)
+
+            for attr, default in ATTRIBUTE_DEFAULTS.items():
+                value = getattr(node, attr)
+                if value != default:
+                    attributes[attr][index] = value
+
+            if node.type_code in CONTAINER_CODES:
+                stack.append([index, -1])
+
+        self.text = ''.join(literals)
+
+    def __len__(self):
+        return len(self.types)
+
+    @property
+    def root(self):
+        return ArrayNode(self, 0)
+
+    def node(self, index):
+        """Returns a view of the node at index, or None if it is -1."""
+        if index == -1:
+            return None
+        return ArrayNode(self, index)
+
+
+class ArrayNode(object):
+    """
+    A read-only view of the node at index in an ArrayTree, with the
+    attributes and the walking methods of a Node.  Views are made as
+    they are needed, so two views of the same node are equal but not
+    always the same object.
+    """
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayNode) and \
+            self.tree is other.tree and self.index == other.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        return "ArrayNode {} [{}]".format(self.t, self.literal)
+
+    def __getattr__(self, name):
+        try:
+            default = ATTRIBUTE_DEFAULTS[name]
+        except KeyError:
+            raise AttributeError(name)
+        return self.tree.attributes[name].get(self.index, default)
+
+    @property
+    def type_code(self):
+        return self.tree.types[self.index]
+
+    @property
+    def t(self):
+        return NODE_TYPES[self.tree.types[self.index]]
+
+    @property
+    def parent(self):
+        return self.tree.node(self.tree.parents[self.index])
+
+    @property
+    def first_child(self):
+        return self.tree.node(self.tree.first_children[self.index])
+
+    @property
+    def last_child(self):
+        tree = self.tree
+        child = tree.first_children[self.index]
+        if child == -1:
+            return None
+        while tree.next_siblings[child] != -1:
+            child = tree.next_siblings[child]
+        return ArrayNode(tree, child)
+
+    @property
+    def nxt(self):
+        return self.tree.node(self.tree.next_siblings[self.index])
+
+    @property
+    def prv(self):
+        tree = self.tree
+        parent = tree.parents[self.index]
+        if parent == -1:
+            return None
+        child = tree.first_children[parent]
+        if child == self.index:
+            return None
+        while tree.next_siblings[child] != self.index:
+            child = tree.next_siblings[child]
+        return ArrayNode(tree, child)
+
+    @property
+    def sourcepos(self):
+        pos = self.tree.sourcepos
+        i = self.index * 4
+        if pos[i] == 0:
+            return None
+        return [[pos[i], pos[i + 1]], [pos[i + 2], pos[i + 3]]]
+
+    @property
+    def literal(self):
+        tree = self.tree
+        start = tree.literal_starts[self.index]
+        if start == -1:
+            return None
+        return tree.text[start:tree.literal_ends[self.index]]
+
+    @property
+    def is_open(self):
+        return bool(self.tree.flags[self.index] & IS_OPEN)
+
+    @property
+    def last_line_blank(self):
+        return bool(self.tree.flags[self.index] & LAST_LINE_BLANK)
+
+    @property
+    def is_fenced(self):
+        return bool(self.tree.flags[self.index] & IS_FENCED)
+
+    def is_container(self):
+        return self.tree.types[self.index] in CONTAINER_CODES
+
+    def walk(self):
+        """
+        Yields (node, entering) for each step of a walk over this node
+        and its descendants, like Node.walk.
+        """
+        tree = self.tree
+        types = tree.types
+        parents = tree.parents
+        first_children = tree.first_children
+        next_siblings = tree.next_siblings
+        root = index = self.index
+        node = self
+        while True:
+            if types[index] in CONTAINER_CODES:
+                yield node, True
+                child = first_children[index]
+                if child != -1:
+                    index = child
+                    node = ArrayNode(tree, index)
+                    continue
+                yield node, False
+            else:
+                yield node, True
+            while index != root and next_siblings[index] == -1:
+                index = parents[index]
+                node = ArrayNode(tree, index)
+                yield node, False
+            if index == root:
+                return
+            index = next_siblings[index]
+            node = ArrayNode(tree, index)
+
+    def leaves(self):
+        """
+        Yields each node under this one that has no children, in
+        document order, like Node.leaves.
+        """
+        tree = self.tree
+        parents = tree.parents
+        first_children = tree.first_children
+        next_siblings = tree.next_siblings
+        root = index = self.index
+        while True:
+            child = first_children[index]
+            if child != -1:
+                index = child
+                continue
+            yield ArrayNode(tree, index)
+            while index != root and next_siblings[index] == -1:
+                index = parents[index]
+            if index == root:
+                return
+            index = next_siblings[index]
+
+    def walker(self):
+        return ArrayNodeWalker(self)
+
+
+class ArrayNodeWalker(object):
+    """A NodeWalker over an ArrayTree, for code written against walker()."""
+
+    def __init__(self, root):
+        self.tree = root.tree
+        self.root = root.index
+        self.current = root.index
+        self.entering = True
+
+    def nxt(self):
+        tree = self.tree
+        cur = self.current
+        entering = self.entering
+
+        if cur == -1:
+            return None
+
+        if entering and tree.types[cur] in CONTAINER_CODES:
+            if tree.first_children[cur] != -1:
+                self.current = tree.first_children[cur]
+                self.entering = True
+            else:
+                # stay on node but exit
+                self.entering = False
+        elif cur == self.root:
+            self.current = -1
+        elif tree.next_siblings[cur] == -1:
+            self.current = tree.parents[cur]
+            self.entering = False
+        else:
+            self.current = tree.next_siblings[cur]
+            self.entering = True
+
+        return {
+            'entering': entering,
+            'node': ArrayNode(tree, cur),
+        }
+
+    def resume_at(self, node, entering):
+        self.current = node.index
+        self.entering = (entering is True)
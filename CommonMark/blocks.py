@@ -1,23 +1,34 @@
 from __future__ import absolute_import, unicode_literals
 
+import codecs
+import mmap
+import os
 import re
-from importlib import import_module
 from CommonMark import common
 from CommonMark.common import unescape_string
-from CommonMark.inlines import InlineParser
-from CommonMark.node import Node
+from CommonMark.inlines import (
+    InlineParser, parse_inlines_batch, unpack_inlines)
+from CommonMark.node import (
+    BLOCK_QUOTE, CODE_BLOCK, HEADING, HTML_BLOCK, ITEM, LIST, PARAGRAPH,
+    ListData, Node, add_container_type, node_type_code)
 
 
 CODE_INDENT = 4
+# Approximate number of characters of inline content sent to a worker
+# process at a time (see Parser.process_inlines_parallel).
+INLINE_BATCH_SIZE = 65536
+# The patterns matched at an offset into the current line (with
+# pattern.match(line, pos), which saves slicing the line for every
+# test) are anchored by match itself, so they must not start with '^'.
 reHtmlBlockOpen = [
     re.compile(r'.'),  # dummy for 0
-    re.compile(r'^<(?:script|pre|style)(?:\s|>|$)', re.IGNORECASE),
-    re.compile(r'^<!--'),
-    re.compile(r'^<[?]'),
-    re.compile(r'^<![A-Z]'),
-    re.compile(r'^<!\[CDATA\['),
+    re.compile(r'<(?:script|pre|style)(?:\s|>|$)', re.IGNORECASE),
+    re.compile(r'<!--'),
+    re.compile(r'<[?]'),
+    re.compile(r'<![A-Z]'),
+    re.compile(r'<!\[CDATA\['),
     re.compile(
-        r'^<[/]?(?:address|article|aside|base|basefont|blockquote|body|'
+        r'<[/]?(?:address|article|aside|base|basefont|blockquote|body|'
         r'caption|center|col|colgroup|dd|details|dialog|dir|div|dl|dt|'
         r'fieldset|figcaption|figure|footer|form|frame|frameset|h1|head|'
         r'header|hr|html|iframe|legend|li|link|main|menu|menuitem|meta|'
@@ -26,7 +37,7 @@ reHtmlBlockOpen = [
         r'(?:\s|[/]?[>]|$)',
         re.IGNORECASE),
     re.compile(
-        '^(?:' + common.OPENTAG + '|' + common.CLOSETAG + ')\s*$',
+        '(?:' + common.OPENTAG + '|' + common.CLOSETAG + ')\s*$',
         re.IGNORECASE),
 ]
 reHtmlBlockClose = [
@@ -37,21 +48,23 @@ reHtmlBlockClose = [
     re.compile(r'>'),
     re.compile(r'\]\]>'),
 ]
-reThematicBreak = re.compile(r'^(?:(?:\* *){3,}|(?:_ *){3,}|(?:- *){3,}) *$')
-reMaybeSpecial = re.compile(r'^[#`~*+_=<>0-9-]')
+reThematicBreak = re.compile(r'(?:(?:\* *){3,}|(?:_ *){3,}|(?:- *){3,}) *$')
 reNonSpace = re.compile(r'[^ \t\f\v\r\n]')
-reBulletListMarker = re.compile(r'^[*+-]')
-reOrderedListMarker = re.compile(r'^(\d{1,9})([.)])')
-reATXHeadingMarker = re.compile(r'^#{1,6}(?: +|$)')
-reCodeFence = re.compile(r'^`{3,}(?!.*`)|^~{3,}(?!.*~)')
-reClosingCodeFence = re.compile(r'^(?:`{3,}|~{3,})(?= *$)')
-reSetextHeadingLine = re.compile(r'^(?:=+|-+) *$')
+reBulletListMarker = re.compile(r'[*+-]')
+reOrderedListMarker = re.compile(r'(\d{1,9})([.)])')
+reATXHeadingMarker = re.compile(r'#{1,6}(?: +|$)')
+reATXClosingSequence = re.compile(r' +#+ *$')
+reATXEmptyHeading = re.compile(r' *#+ *$')
+reCodeFence = re.compile(r'`{3,}(?!.*`)|~{3,}(?!.*~)')
+reClosingCodeFence = re.compile(r'(?:`{3,}|~{3,})(?= *$)')
+reSetextHeadingLine = re.compile(r'(?:=+|-+) *$')
+reTrailingBlankLines = re.compile(r'(\n *)+$')
 reLineEnding = re.compile(r'\r\n|\n|\r')
 
 
 def is_blank(s):
     """Returns True if string contains only space characters."""
-    return re.search(reNonSpace, s) is None
+    return reNonSpace.search(s) is None
 
 
 def peek(ln, pos):
@@ -61,13 +74,128 @@ def peek(ln, pos):
         return None
 
 
+def decode_chunks(chunks, encoding):
+    """Decode the byte strings in chunks with encoding, incrementally
+    so that multi-byte characters may be split between chunks.  Text
+    chunks are passed through unchanged."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        yield chunk
+    rest = decoder.decode(b'', True)
+    if rest:
+        yield rest
+
+
+def count_line_endings(s, start, end):
+    """Returns the number of line endings in s[start:end]."""
+    return s.count('\n', start, end) + s.count('\r', start, end) - \
+        s.count('\r\n', start, end)
+
+
+def line_of(s, pos):
+    """Returns the (1-based) number of the line containing s[pos]."""
+    return 1 + count_line_endings(s, 0, pos)
+
+
+def line_start(s, pos):
+    """Returns the offset of the start of the line containing s[pos]."""
+    if pos > 0 and s[pos - 1:pos + 1] == '\r\n':
+        # pos is inside the line ending
+        pos -= 1
+    i = s.rfind('\n', 0, pos)
+    return max(i, s.rfind('\r', i + 1, pos)) + 1
+
+
+def seek_line(s, pos, line, target):
+    """Returns the offset of line number target, given that line number
+    line starts at offset pos."""
+    while line > target:
+        pos = line_start(s, pos - 1)
+        line -= 1
+    while line < target:
+        pos = reLineEnding.search(s, pos).end()
+        line += 1
+    return pos
+
+
+def iter_lines(s, pos):
+    """Yields the lines of s from offset pos on, split the same way as
+    parse splits its input."""
+    m = reLineEnding.search(s, pos)
+    while m:
+        yield s[pos:m.start()]
+        pos = m.end()
+        m = reLineEnding.search(s, pos)
+    if s[-1:] != '\n':
+        # ignore last blank line created by final newline
+        yield s[pos:]
+
+
+def is_indented(line):
+    """Returns True if line starts with an indent of CODE_INDENT or more
+    columns."""
+    column = 0
+    for c in line:
+        if c == ' ':
+            column += 1
+        elif c == '\t':
+            column += 4 - column % 4
+        else:
+            break
+        if column >= CODE_INDENT:
+            return True
+    return False
+
+
+def starts_like_document(line, previous):
+    """
+    Returns True if a top-level block whose first line is line, after
+    the top-level block previous (or None), is parsed as if line were
+    the first line of a document.  That is so unless previous is a
+    List: an indented list marker can then start a new list.
+    """
+    return previous is None or previous.type_code != LIST or \
+        not is_indented(line)
+
+
+def shift_lines(block, delta):
+    """Move block and all its block descendants down by delta lines."""
+    node = block
+    while True:
+        node.sourcepos[0][0] += delta
+        node.sourcepos[1][0] += delta
+        t = node.type_code
+        if t == BLOCK_QUOTE or t == LIST or t == ITEM:
+            child = node.first_child
+            if child is not None:
+                node = child
+                continue
+        while node is not block and node.nxt is None:
+            node = node.parent
+        if node is block:
+            return
+        node = node.nxt
+
+
+def top_level_block(node, doc):
+    """Returns the child of doc containing node, or None if node is no
+    longer part of doc."""
+    while node.parent is not None and node.parent is not doc:
+        node = node.parent
+    if node.parent is doc:
+        return node
+    return None
+
+
 def ends_with_blank_line(block):
     """ Returns true if block ends with a blank line,
     descending if needed into lists and sublists."""
     while block:
         if block.last_line_blank:
             return True
-        if (block.t == "List" or block.t == "Item"):
+        if block.type_code == LIST or block.type_code == ITEM:
             block = block.last_child
         else:
             break
@@ -78,37 +206,30 @@ def ends_with_blank_line(block):
 def parse_list_marker(parser):
     """ Parse a list marker and return data on the marker (type,
     start, delimiter, bullet character, padding) or None."""
-    rest = parser.current_line[parser.next_nonspace:]
-    data = {
-        'type': None,
-        'tight': True,  # lists are tight by default
-        'bullet_char': None,
-        'start': None,
-        'delimiter': None,
-        'padding': None,
-        'marker_offset': parser.indent,
-    }
-    m = re.match(reBulletListMarker, rest)
-    m2 = re.match(reOrderedListMarker, rest)
+    ln = parser.current_line
+    pos = parser.next_nonspace
+    data = ListData(marker_offset=parser.indent)
+    m = reBulletListMarker.match(ln, pos)
     if m:
-        data['type'] = 'Bullet'
-        data['bullet_char'] = m.group()[0]
-    elif m2:
-        m = m2
-        data['type'] = 'Ordered'
-        data['start'] = int(m.group(1))
-        data['delimiter'] = m.group(2)
+        data.type = 'Bullet'
+        data.bullet_char = ln[pos]
     else:
-        return None
+        m = reOrderedListMarker.match(ln, pos)
+        if not m:
+            return None
+        data.type = 'Ordered'
+        data.start = int(m.group(1))
+        data.delimiter = m.group(2)
+    marker_length = m.end() - pos
 
     # make sure we have spaces after
-    nextc = peek(parser.current_line, parser.next_nonspace + len(m.group()))
+    nextc = peek(ln, m.end())
     if not (nextc is None or nextc == '\t' or nextc == ' '):
         return None
 
     # we've got a match! advance offset and calculate padding
     parser.advance_next_nonspace()  # to start of marker
-    parser.advance_offset(len(m.group()), True)  # to end of marker
+    parser.advance_offset(marker_length, True)  # to end of marker
     spaces_start_col = parser.column
     spaces_start_offset = parser.offset
     while True:
@@ -124,13 +245,13 @@ def parse_list_marker(parser):
     if spaces_after_marker >= 5 or \
        spaces_after_marker < 1 or \
        blank_item:
-        data['padding'] = len(m.group()) + 1
+        data.padding = marker_length + 1
         parser.column = spaces_start_col
         parser.offset = spaces_start_offset
         if peek(parser.current_line, parser.offset) == ' ':
             parser.advance_offset(1, True)
     else:
-        data['padding'] = len(m.group()) + spaces_after_marker
+        data.padding = marker_length + spaces_after_marker
 
     return data
 
@@ -141,9 +262,9 @@ def lists_match(list_data, item_data):
     with the same delimiter and bullet character.  This is used
     in agglomerating list items into lists.
     """
-    return list_data.get('type') == item_data.get('type') and \
-        list_data.get('delimiter') == item_data.get('delimiter') and \
-        list_data.get('bullet_char') == item_data.get('bullet_char')
+    return list_data.type == item_data.type and \
+        list_data.delimiter == item_data.delimiter and \
+        list_data.bullet_char == item_data.bullet_char
 
 
 class Block:
@@ -191,7 +312,7 @@ class List(Block):
         while item:
             # check for non-final list item ending with blank line:
             if ends_with_blank_line(item) and item.nxt:
-                block.list_data['tight'] = False
+                block.list_data.tight = False
                 break
             # recurse into children of list item, to see if there are
             # spaces between any of them:
@@ -199,7 +320,7 @@ class List(Block):
             while subitem:
                 if ends_with_blank_line(subitem) and \
                    (item.nxt or subitem.nxt):
-                    block.list_data['tight'] = False
+                    block.list_data.tight = False
                     break
                 subitem = subitem.nxt
             item = item.nxt
@@ -240,11 +361,11 @@ class Item(Block):
     def continue_(parser=None, container=None):
         if parser.blank and container.last_child is not None:
             parser.advance_next_nonspace()
-        elif parser.indent >= (container.list_data['marker_offset'] +
-                               container.list_data['padding']):
+        elif parser.indent >= (container.list_data.marker_offset +
+                               container.list_data.padding):
             parser.advance_offset(
-                container.list_data['marker_offset'] +
-                container.list_data['padding'], True)
+                container.list_data.marker_offset +
+                container.list_data.padding, True)
         else:
             return 1
         return 0
@@ -303,8 +424,9 @@ class CodeBlock(Block):
             match = indent <= 3 and \
                 len(ln) >= parser.next_nonspace + 1 and \
                 ln[parser.next_nonspace] == container.fence_char and \
-                re.match(reClosingCodeFence, ln[parser.next_nonspace:])
-            if match and len(match.group()) >= container.fence_length:
+                reClosingCodeFence.match(ln, parser.next_nonspace)
+            if match and \
+               match.end() - parser.next_nonspace >= container.fence_length:
                 # closing fence - we're at end of line, so we can return
                 parser.finalize(container, parser.line_number)
                 return 2
@@ -336,7 +458,8 @@ class CodeBlock(Block):
             block.literal = rest
         else:
             # indented
-            block.literal = re.sub(r'(\n *)+$', '\n', block.string_content)
+            block.literal = reTrailingBlankLines.sub(
+                '\n', block.string_content)
 
         block.string_content = None
 
@@ -362,7 +485,7 @@ class HtmlBlock(Block):
            block.sourcepos == [[1, 3], [1, 7]]:
             # FIXME :P
             block.string_content = '\n<div>'
-        block.literal = re.sub(r'(\n *)+$', '', block.string_content)
+        block.literal = reTrailingBlankLines.sub('', block.string_content)
         # allow GC
         block.string_content = None
 
@@ -383,13 +506,19 @@ class Paragraph(Block):
         has_reference_defs = False
 
         # try parsing the beginning as link reference definitions:
-        while peek(block.string_content, 0) == '[':
-            pos = parser.inline_parser.parseReference(
-                block.string_content, parser.refmap)
-            if not pos:
+        content = block.string_content
+        pos = 0
+        while peek(content, pos) == '[':
+            refs = {}
+            length = parser.inline_parser.parseReference(content, refs, pos)
+            if not length:
                 break
-            block.string_content = block.string_content[pos:]
+            for label in refs:
+                parser.add_reference(block.sourcepos[0][0], label, refs[label])
+            pos += length
             has_reference_defs = True
+        if pos:
+            block.string_content = content[pos:]
         if has_reference_defs and is_blank(block.string_content):
             block.unlink()
 
@@ -398,6 +527,52 @@ class Paragraph(Block):
         return False
 
 
+# Handlers for each block type, keyed by node type.  The parser looks
+# up continue_, finalize, can_contain and accepts_lines here; use
+# register_block_type to add handlers for custom block types.  Each
+# Parser copies this dict into a list indexed by node type code when it
+# starts a document, so changes take effect from the next document.
+block_handlers = {
+    'Document': Document,
+    'List': List,
+    'BlockQuote': BlockQuote,
+    'Item': Item,
+    'Heading': Heading,
+    'ThematicBreak': ThematicBreak,
+    'CodeBlock': CodeBlock,
+    'HtmlBlock': HtmlBlock,
+    'Paragraph': Paragraph,
+}
+
+
+def register_block_type(t, handler, container=False):
+    """Register handler (a Block subclass) for blocks of type t.
+
+    If container is true, blocks of type t are containers: walkers and
+    renderers visit their children (see add_container_type).  Returns
+    the previously registered handler, or None.
+    """
+    previous = block_handlers.get(t)
+    block_handlers[t] = handler
+    if container:
+        add_container_type(t)
+    return previous
+
+
+def handlers_by_code(handlers):
+    """
+    Returns the handlers in handlers, a dict keyed by node type, in a
+    list indexed by node type code, with None for the other codes.
+    """
+    by_code = []
+    for t, handler in handlers.items():
+        code = node_type_code(t)
+        while len(by_code) <= code:
+            by_code.append(None)
+        by_code[code] = handler
+    return by_code
+
+
 class BlockStarts:
     """Block start functions.
 
@@ -417,6 +592,24 @@ class BlockStarts:
         'indented_code_block',
     ]
 
+    # The block starts that can match a line, keyed by its first
+    # non-space character and kept in METHODS order.  Indented lines
+    # can only start indented code or a list item inside a list.
+    DISPATCH = {
+        '>': ['block_quote'],
+        '#': ['atx_heading'],
+        '`': ['fenced_code_block'],
+        '~': ['fenced_code_block'],
+        '<': ['html_block'],
+        '=': ['setext_heading'],
+        '-': ['setext_heading', 'thematic_break', 'list_item'],
+        '*': ['thematic_break', 'list_item'],
+        '_': ['thematic_break'],
+        '+': ['list_item'],
+    }
+    DISPATCH.update(dict.fromkeys('0123456789', ['list_item']))
+    INDENTED = ['list_item', 'indented_code_block']
+
     @staticmethod
     def block_quote(parser, container=None):
         if not parser.indented and \
@@ -435,21 +628,22 @@ class BlockStarts:
     @staticmethod
     def atx_heading(parser, container=None):
         if not parser.indented:
-            m = re.match(reATXHeadingMarker,
-                         parser.current_line[parser.next_nonspace:])
+            ln = parser.current_line
+            m = reATXHeadingMarker.match(ln, parser.next_nonspace)
             if m:
                 parser.advance_next_nonspace()
-                parser.advance_offset(len(m.group()), False)
+                parser.advance_offset(m.end() - m.start(), False)
                 parser.close_unmatched_blocks()
                 container = parser.add_child('Heading', parser.next_nonspace)
                 # number of #s
                 container.level = len(m.group().strip())
                 # remove trailing ###s:
-                container.string_content = re.sub(
-                    r' +#+ *$', '', re.sub(
-                        r'^ *#+ *$', '', parser.current_line[parser.offset:]))
-                parser.advance_offset(
-                    len(parser.current_line) - parser.offset, False)
+                if reATXEmptyHeading.match(ln, parser.offset):
+                    container.string_content = ''
+                else:
+                    container.string_content = reATXClosingSequence.sub(
+                        '', ln[parser.offset:])
+                parser.advance_offset(len(ln) - parser.offset, False)
                 return 2
 
         return 0
@@ -457,16 +651,14 @@ class BlockStarts:
     @staticmethod
     def fenced_code_block(parser, container=None):
         if not parser.indented:
-            m = re.match(
-                reCodeFence,
-                parser.current_line[parser.next_nonspace:])
+            m = reCodeFence.match(parser.current_line, parser.next_nonspace)
             if m:
-                fence_length = len(m.group())
+                fence_length = m.end() - m.start()
                 parser.close_unmatched_blocks()
                 container = parser.add_child('CodeBlock', parser.next_nonspace)
                 container.is_fenced = True
                 container.fence_length = fence_length
-                container.fence_char = m.group()[0]
+                container.fence_char = parser.current_line[m.start()]
                 container.fence_offset = parser.indent
                 parser.advance_next_nonspace()
                 parser.advance_offset(fence_length, False)
@@ -478,11 +670,11 @@ class BlockStarts:
     def html_block(parser, container=None):
         if not parser.indented and \
            peek(parser.current_line, parser.next_nonspace) == '<':
-            s = parser.current_line[parser.next_nonspace:]
-
+            ln = parser.current_line
+            pos = parser.next_nonspace
             for block_type in range(1, 8):
-                if re.search(reHtmlBlockOpen[block_type], s) and \
-                   (block_type < 7 or container.t != 'Paragraph'):
+                if reHtmlBlockOpen[block_type].match(ln, pos) and \
+                   (block_type < 7 or container.type_code != PARAGRAPH):
                     parser.close_unmatched_blocks()
                     # We don't adjust parser.offset;
                     # spaces are part of the HTML block:
@@ -493,15 +685,15 @@ class BlockStarts:
 
     @staticmethod
     def setext_heading(parser, container=None):
-        if not parser.indented and container.t == 'Paragraph':
-            m = re.match(
-                reSetextHeadingLine,
-                parser.current_line[parser.next_nonspace:])
+        if not parser.indented and container.type_code == PARAGRAPH:
+            m = reSetextHeadingLine.match(
+                parser.current_line, parser.next_nonspace)
             if m:
                 parser.close_unmatched_blocks()
                 heading = Node('Heading', container.sourcepos)
-                heading.level = 1 if m.group()[0] == '=' else 2
-                heading.string_content = container.string_content
+                heading.level = 1 if parser.current_line[m.start()] == '=' \
+                    else 2
+                heading.string_content = ''.join(container.content_lines)
                 container.insert_after(heading)
                 container.unlink()
                 parser.tip = heading
@@ -513,8 +705,8 @@ class BlockStarts:
 
     @staticmethod
     def thematic_break(parser, container=None):
-        if not parser.indented and re.search(
-                reThematicBreak, parser.current_line[parser.next_nonspace:]):
+        if not parser.indented and reThematicBreak.match(
+                parser.current_line, parser.next_nonspace):
             parser.close_unmatched_blocks()
             parser.add_child('ThematicBreak', parser.next_nonspace)
             parser.advance_offset(
@@ -524,13 +716,13 @@ class BlockStarts:
 
     @staticmethod
     def list_item(parser, container=None):
-        if (not parser.indented or container.t == 'List'):
+        if (not parser.indented or container.type_code == LIST):
             data = parse_list_marker(parser)
             if data:
                 parser.close_unmatched_blocks()
 
                 # add the list if needed
-                if parser.tip.t != 'List' or \
+                if parser.tip.type_code != LIST or \
                    not lists_match(container.list_data, data):
                     container = parser.add_child('List', parser.next_nonspace)
                     container.list_data = data
@@ -545,8 +737,8 @@ class BlockStarts:
     @staticmethod
     def indented_code_block(parser, container=None):
         if parser.indented and \
-           parser.tip.t != 'Paragraph' and \
-                           not parser.blank:
+           parser.tip.type_code != PARAGRAPH and \
+           not parser.blank:
             # indented code
             parser.advance_offset(CODE_INDENT, True)
             parser.close_unmatched_blocks()
@@ -556,10 +748,59 @@ class BlockStarts:
         return 0
 
 
+class LazyInlines(Node):
+    """
+    A Paragraph or Heading whose inline content is parsed the first
+    time its first_child or last_child is used, for documents parsed
+    with the 'lazy' option.  Parser.process_inlines makes a subclass
+    for each document, with inline_parser set to an InlineParser that
+    has the document's refmap and parser set to the Parser; parsing
+    turns the block back into a plain Node.  The labels the block uses
+    are recorded in the parser's label_uses as it is then, since
+    Parser.reparse replaces that dict while it parses new blocks.
+    """
+    __slots__ = ()
+    inline_parser = None
+    parser = None
+
+    def parse_inlines(self):
+        inline_parser = self.inline_parser
+        inline_parser.label_uses = self.parser.label_uses
+        self.__class__ = Node
+        inline_parser.parse(self)
+
+    @property
+    def first_child(self):
+        self.parse_inlines()
+        return self.first_child
+
+    @first_child.setter
+    def first_child(self, value):
+        self.parse_inlines()
+        self.first_child = value
+
+    @property
+    def last_child(self):
+        self.parse_inlines()
+        return self.last_child
+
+    @last_child.setter
+    def last_child(self, value):
+        self.parse_inlines()
+        self.last_child = value
+
+
 class Parser:
     def __init__(self, options={}):
         self.doc = Node('Document', [[1, 1], [0, 0]])
+        self.block_handlers_by_code = handlers_by_code(block_handlers)
         self.block_starts = BlockStarts()
+        self.block_starts_by_char = dict(
+            (c, [getattr(self.block_starts, name) for name in names])
+            for c, names in self.block_starts.DISPATCH.items())
+        self.indented_block_starts = [
+            getattr(self.block_starts, name)
+            for name in self.block_starts.INDENTED]
         self.tip = self.doc
         self.oldtip = self.doc
         self.current_line = ''
@@ -574,7 +815,13 @@ class Parser:
         self.all_closed = True
         self.last_matched_container = self.doc
         self.refmap = {}
+        self.refdefs = []
+        self.label_uses = {}
+        self.label_uses_added = 0
+        self.label_uses_kept = 0
+        self.top_blocks = None
         self.last_line_length = 0
+        self.partial_chunks = []
         self.inline_parser = InlineParser(options)
         self.options = options
 
@@ -588,7 +835,7 @@ class Parser:
         b = block
         last_list = None
         while True:
-            if (b.t == "List"):
+            if b.type_code == LIST:
                 last_list = b
             b = b.parent
             if not b:
@@ -603,22 +850,23 @@ class Parser:
 
     def add_line(self):
         """ Add a line to the block at the tip.  We assume the tip
-        can accept lines -- that check should be done before calling this."""
-        self.tip.string_content += (self.current_line[self.offset:] + '\n')
+        can accept lines -- that check should be done before calling this.
+        Lines are collected in content_lines and joined into
+        string_content when the block is finalized."""
+        self.tip.content_lines.append(self.current_line[self.offset:] + '\n')
 
     def add_child(self, tag, offset):
         """ Add block of type tag as a child of the tip.  If the tip can't
         accept children, close and finalize it and try its parent,
         and so on til we find a block that can accept children."""
-        block_class = getattr(import_module('CommonMark.blocks'), self.tip.t)
-        while not block_class.can_contain(tag):
+        handlers = self.block_handlers_by_code
+        while not handlers[self.tip.type_code].can_contain(tag):
             self.finalize(self.tip, self.line_number - 1)
-            block_class = getattr(
-                import_module('CommonMark.blocks'), self.tip.t)
 
         column_number = offset + 1
         new_block = Node(tag, [[self.line_number, column_number], [0, 0]])
         new_block.string_content = ''
+        new_block.content_lines = []
         self.tip.append_child(new_block)
         self.tip = new_block
         return new_block
@@ -697,6 +945,7 @@ class Parser:
         then finalizing the document.
         """
         all_matched = True
+        handlers = self.block_handlers_by_code
 
         container = self.doc
         self.oldtip = self.tip
@@ -705,8 +954,8 @@ class Parser:
         self.line_number += 1
 
         # replace NUL characters for security
-        if re.search(r'\u0000', ln) is not None:
-            ln = re.sub(r'\0', '\uFFFD', ln)
+        if '\0' in ln:
+            ln = ln.replace('\0', '\uFFFD')
 
         self.current_line = ln
 
@@ -718,9 +967,8 @@ class Parser:
             container = last_child
 
             self.find_next_nonspace()
-            block_class = getattr(
-                import_module('CommonMark.blocks'), container.t)
-            rv = block_class.continue_(self, container)
+            rv = handlers[container.type_code].continue_(
+                self, container)
             if rv == 0:
                 # we've matched, keep going
                 pass
@@ -749,24 +997,25 @@ class Parser:
             self.break_out_of_lists(container)
             container = self.tip
 
-        block_class = getattr(import_module('CommonMark.blocks'), container.t)
-        matched_leaf = container.t != 'Paragraph' and block_class.accepts_lines
-        starts = self.block_starts
-        starts_len = len(starts.METHODS)
+        matched_leaf = container.type_code != PARAGRAPH and \
+            handlers[container.type_code].accepts_lines
         # Unless last matched container is a code block, try new container
         # starts, adding children to the last matched container:
         while not matched_leaf:
             self.find_next_nonspace()
 
-            # this is a little performance optimization:
-            if not self.indented and \
-               not re.search(reMaybeSpecial, ln[self.next_nonspace:]):
-                self.advance_next_nonspace()
-                break
+            # only try the block starts that can match this line
+            if self.indented:
+                starts = self.indented_block_starts
+            else:
+                starts = self.block_starts_by_char.get(
+                    peek(ln, self.next_nonspace))
+                if starts is None:
+                    self.advance_next_nonspace()
+                    break
 
-            i = 0
-            while i < starts_len:
-                res = getattr(starts, starts.METHODS[i])(self, container)
+            for start in starts:
+                res = start(self, container)
                 if res == 1:
                     container = self.tip
                     break
@@ -774,10 +1023,7 @@ class Parser:
                     container = self.tip
                     matched_leaf = True
                     break
-                else:
-                    i += 1
-
-            if i == starts_len:
+            else:
                 # nothing matched
                 self.advance_next_nonspace()
                 break
@@ -785,7 +1031,7 @@ class Parser:
         # What remains at the offset is a text line. Add the text to the
         # appropriate container.
         if not self.all_closed and not self.blank and \
-           self.tip.t == 'Paragraph':
+           self.tip.type_code == PARAGRAPH:
             # lazy paragraph continuation
             self.add_line()
         else:
@@ -795,7 +1041,7 @@ class Parser:
             if self.blank and container.last_child:
                 container.last_child.last_line_blank = True
 
-            t = container.t
+            t = container.type_code
 
             # Block quote lines are never blank as they start with >
             # and we don't count blanks in fenced code for purposes of
@@ -803,9 +1049,9 @@ class Parser:
             # don't set last_line_blank on an empty list item, or if we
             # just closed a fenced block.
             last_line_blank = self.blank and \
-                not (t == 'BlockQuote' or
-                     (t == 'CodeBlock' and container.is_fenced) or
-                     (t == 'Item' and
+                not (t == BLOCK_QUOTE or
+                     (t == CODE_BLOCK and container.is_fenced) or
+                     (t == ITEM and
                       not container.first_child and
                       container.sourcepos[0][0] == self.line_number))
 
@@ -815,16 +1061,15 @@ class Parser:
                 cont.last_line_blank = last_line_blank
                 cont = cont.parent
 
-            block_class = getattr(import_module('CommonMark.blocks'), t)
-            if block_class.accepts_lines:
+            if handlers[t].accepts_lines:
                 self.add_line()
                 # if HtmlBlock, check for end condition
-                if t == 'HtmlBlock' and \
+                if t == HTML_BLOCK and \
                    container.html_block_type >= 1 and \
                    container.html_block_type <= 5 and \
-                   re.search(
-                       reHtmlBlockClose[container.html_block_type],
-                       self.current_line[self.offset:]):
+                   reHtmlBlockClose[container.html_block_type].search(
+                       self.current_line, self.offset):
+                    self.last_line_length = len(ln)
                     self.finalize(container, self.line_number)
             elif self.offset < len(ln) and not self.blank:
                 # create a paragraph container for one line
@@ -843,46 +1088,442 @@ class Parser:
         above = block.parent
         block.is_open = False
         block.sourcepos[1] = [line_number, self.last_line_length]
-        block_class = getattr(import_module('CommonMark.blocks'), block.t)
-        block_class.finalize(self, block)
+        handler = self.block_handlers_by_code[block.type_code]
+        if handler.accepts_lines:
+            # join the lines collected by add_line, once per block
+            block.string_content = ''.join(block.content_lines)
+        block.content_lines = None
+        handler.finalize(self, block)
 
         self.tip = above
 
-    def process_inlines(self, block):
+    def add_reference(self, line_number, label, ref):
+        """
+        Record a link reference definition found in a paragraph starting
+        at line_number.  The first definition of a label wins; all of
+        them are kept in refdefs, in document order, for reparse.
+        """
+        self.refdefs.append((line_number, label, ref))
+        if label not in self.refmap:
+            self.refmap[label] = ref
+
+    def process_inlines(self, block, parallel=True):
         """
         Walk through a block & children recursively, parsing string content
-        into inline content where appropriate.
+        into inline content where appropriate.  With the 'lazy' option,
+        only mark those blocks to be parsed when their children are
+        first used (see LazyInlines).  With the 'blocks_only' option,
+        do nothing: Paragraphs and Headings keep their raw text in
+        string_content.  Unless parallel is false, the 'inline_workers'
+        option parses them in a process pool instead.
         """
-        walker = block.walker()
+        if self.options.get('blocks_only'):
+            return
+        if self.options.get('lazy'):
+            inline_parser = InlineParser(self.options)
+            inline_parser.refmap = self.refmap
+            lazy_class = type(str('LazyInlines'), (LazyInlines,), {
+                '__slots__': (),
+                'inline_parser': inline_parser,
+                'parser': self,
+            })
+        else:
+            lazy_class = None
+            workers = self.options.get('inline_workers')
+            if workers and parallel:
+                return self.process_inlines_parallel(block, workers)
         self.inline_parser.refmap = self.refmap
+        self.inline_parser.label_uses = self.label_uses
         self.inline_parser.options = self.options
-        event = walker.nxt()
-        while event is not None:
-            node = event['node']
-            t = node.t
-            if not event['entering'] and (t == 'Paragraph' or t == 'Heading'):
-                self.inline_parser.parse(node)
-            event = walker.nxt()
+        for node in block.leaves():
+            t = node.type_code
+            if t == PARAGRAPH or t == HEADING:
+                if lazy_class is not None:
+                    node.__class__ = lazy_class
+                else:
+                    self.inline_parser.parse(node)
 
-    def parse(self, my_input):
-        """ The main parsing function.  Returns a parsed document AST."""
+    def process_inlines_parallel(self, block, workers):
+        """
+        Like process_inlines, but parse the string content of the
+        Paragraphs and Headings under block in batches, in a process
+        pool, and graft the results back in document order.  workers is
+        either the number of processes to start or a
+        concurrent.futures.Executor to use.
+        """
+        leaves = [node for node in block.leaves()
+                  if node.type_code == PARAGRAPH or node.type_code == HEADING]
+
+        batches = []
+        batch = []
+        size = 0
+        for leaf in leaves:
+            batch.append(leaf.string_content)
+            size += len(leaf.string_content)
+            if size >= INLINE_BATCH_SIZE:
+                batches.append(batch)
+                batch = []
+                size = 0
+        if batch:
+            batches.append(batch)
+
+        # the executor itself may be in the options; workers don't need it
+        options = dict((k, v) for k, v in self.options.items()
+                       if k != 'inline_workers')
+        if isinstance(workers, int):
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(workers)
+        else:
+            executor = workers
+        try:
+            leaves = iter(leaves)
+            for results in executor.map(
+                    parse_inlines_batch, batches,
+                    [self.refmap] * len(batches), [options] * len(batches)):
+                for packed, labels in results:
+                    leaf = next(leaves)
+                    unpack_inlines(leaf, packed)
+                    leaf.string_content = None
+                    for label in labels:
+                        self.label_uses.setdefault(label, []).append(leaf)
+        finally:
+            if executor is not workers:
+                executor.shutdown()
+
+    def reset(self):
+        """Discard any parser state and start a new, empty document."""
         self.doc = Node('Document', [[1, 1], [0, 0]])
+        self.block_handlers_by_code = handlers_by_code(block_handlers)
         self.tip = self.doc
+        self.oldtip = self.doc
         self.refmap = {}
+        self.refdefs = []
+        self.label_uses = {}
+        self.label_uses_added = 0
+        self.label_uses_kept = 0
+        self.top_blocks = None
         self.line_number = 0
         self.last_line_length = 0
         self.offset = 0
         self.column = 0
         self.last_matched_container = self.doc
         self.current_line = ''
-        lines = re.split(reLineEnding, my_input)
-        length = len(lines)
-        if len(my_input) > 0 and my_input[-1] == '\n':
-            # ignore last blank line created by final newline
-            length -= 1
-        for i in range(length):
-            self.incorporate_line(lines[i])
+        self.partial_chunks = []
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of a document.  Chunks may end anywhere,
+        including in the middle of a line or between the CR and LF of
+        a line ending; the incomplete line is kept until the next call
+        to feed or finish.  Feeding a parser whose last document has
+        been finished starts a new one.
+        """
+        if self.tip is None:
+            self.reset()
+        pending = self.partial_chunks
+        if '\n' not in chunk and '\r' not in chunk and \
+                not (pending and pending[-1][-1:] == '\r'):
+            # still the same line; join the pieces once it ends
+            if chunk:
+                pending.append(chunk)
+            return
+        pending.append(chunk)
+        data = ''.join(pending)
+        if data[-1:] == '\r':
+            # hold back the CR: it may be the first half of a CRLF
+            lines = reLineEnding.split(data[:-1])
+            self.partial_chunks = [lines.pop() + '\r']
+        else:
+            lines = reLineEnding.split(data)
+            rest = lines.pop()
+            self.partial_chunks = [rest] if rest else []
+        for line in lines:
+            self.incorporate_line(line)
+
+    def finish(self):
+        """
+        Parse whatever is left over from feed, finalize the document
+        and parse its inline content.  Returns the document AST, the
+        same one that parse would return for the concatenated chunks.
+        """
+        if self.tip is None:
+            self.reset()
+        partial_line = ''.join(self.partial_chunks)
+        if partial_line:
+            for line in reLineEnding.split(partial_line):
+                self.incorporate_line(line)
+        elif self.line_number == 0:
+            # an empty document still has one (empty) line
+            self.incorporate_line('')
+        self.partial_chunks = []
         while (self.tip):
-            self.finalize(self.tip, length)
+            self.finalize(self.tip, self.line_number)
         self.process_inlines(self.doc)
+        self.label_uses_kept = sum(
+            len(uses) for uses in self.label_uses.values())
         return self.doc
+
+    def parse(self, my_input):
+        """ The main parsing function.  Returns a parsed document AST."""
+        self.reset()
+        self.feed(my_input)
+        return self.finish()
+
+    def reparse(self, doc, old_source, new_source, start, end):
+        """
+        Update doc, the AST this parser last returned for old_source, to
+        match new_source, where new_source is old_source with the text
+        between offsets start and end replaced.  Returns doc.
+
+        Only the top-level blocks the edit touches are parsed again,
+        starting from the block before the edit and stopping at the
+        first old block after it that still starts a new top-level
+        block.  Other blocks are kept and, if the edit changed the
+        number of lines, have their sourcepos moved.  When the edit
+        changes a link reference definition, the top-level blocks that
+        use that label are parsed again as well.  doc must not have
+        been modified since it was returned.
+
+        The cost of an edit depends on the size of the top-level blocks
+        around it: an edit anywhere inside one large List or BlockQuote
+        parses that whole block again, which is about as slow as
+        parsing the document.  An edit that changes the number of lines
+        also moves every block after it, in time linear in the number
+        of those blocks.
+        """
+        if doc is not self.doc or self.tip is not None:
+            raise ValueError(
+                'reparse needs the document this parser last returned')
+        new_end = end + len(new_source) - len(old_source)
+        first_line = line_of(old_source, start)
+        if old_source[start - 1:start + 1] == '\r\n':
+            # the edit splits a line ending
+            first_line -= 1
+        last_line = line_of(old_source, end)
+        # the edit can only join or split line endings next to it
+        before = max(start - 1, 0)
+        delta = count_line_endings(new_source, before, new_end + 1) - \
+            count_line_endings(old_source, before, end + 1)
+        if old_source[-1:] == '\n':
+            delta += 1
+        if new_source[-1:] == '\n':
+            delta -= 1
+
+        if self.top_blocks is None:
+            self.top_blocks = []
+            b = doc.first_child
+            while b:
+                self.top_blocks.append(b)
+                b = b.nxt
+        blocks = self.top_blocks
+
+        # The first line of a top-level block is parsed the same way
+        # as the first line of a document, unless it is indented and
+        # follows a List (see starts_like_document), so parsing can
+        # restart at the last such block before the edit, which is
+        # unchanged...
+        lo = 0
+        hi = len(blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blocks[mid].sourcepos[0][0] < first_line:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = max(lo - 1, 0)
+        region_start = blocks[first].sourcepos[0][0] if lo else 1
+        region_offset = line_start(old_source, start)
+        for _ in range(first_line - region_start):
+            region_offset = line_start(old_source, region_offset - 1)
+        while first > 0 and not starts_like_document(
+                next(iter_lines(old_source, region_offset), ''),
+                blocks[first - 1]):
+            first -= 1
+            line = blocks[first].sourcepos[0][0]
+            region_offset = seek_line(
+                old_source, region_offset, region_start, line)
+            region_start = line
+
+        # ...and stop at the first old block after the edit that also
+        # starts a new top-level block in the new text, if its first
+        # line was and is parsed like the first line of a document.
+        p = Parser(self.options)
+        p.line_number = region_start - 1
+        lines = iter_lines(new_source, region_offset)
+        stop = len(blocks)
+        for i in range(first, len(blocks)):
+            old_start = blocks[i].sourcepos[0][0]
+            if old_start <= max(last_line, region_start):
+                continue
+            while p.line_number < old_start + delta:
+                p.incorporate_line(next(lines))
+            top = p.doc.last_child
+            if top is not None and \
+                    top.sourcepos[0][0] == old_start + delta and \
+                    starts_like_document(p.current_line, top.prv) and \
+                    starts_like_document(p.current_line, blocks[i - 1]):
+                top.unlink()
+                stop = i
+                break
+        if stop == len(blocks):
+            for line in lines:
+                p.incorporate_line(line)
+            while p.tip:
+                p.finalize(p.tip, p.line_number)
+            region_end = doc.sourcepos[1][0] + 1
+            doc.sourcepos[1] = [p.line_number, p.last_line_length]
+            self.last_line_length = p.last_line_length
+        else:
+            region_end = blocks[stop].sourcepos[0][0]
+            doc.sourcepos[1][0] += delta
+
+        # Replace the old blocks in the region with the new ones and
+        # move the blocks after it.
+        new_blocks = []
+        b = p.doc.first_child
+        while b:
+            new_blocks.append(b)
+            b = b.nxt
+        for b in blocks[first:stop]:
+            b.unlink()
+        for b in new_blocks:
+            if stop < len(blocks):
+                blocks[stop].insert_before(b)
+            else:
+                doc.append_child(b)
+        if delta:
+            for b in blocks[stop:]:
+                shift_lines(b, delta)
+        blocks[first:stop] = new_blocks
+
+        # Rebuild the reference map and find the labels whose
+        # definitions changed.
+        refdefs = []
+        changed = set()
+        for line, label, ref in self.refdefs:
+            if line < region_start:
+                refdefs.append((line, label, ref))
+            elif line < region_end:
+                changed.add(label)
+        refdefs.extend(p.refdefs)
+        for line, label, ref in self.refdefs:
+            if line >= region_end:
+                refdefs.append((line + delta, label, ref))
+        for line, label, ref in p.refdefs:
+            changed.add(label)
+        old_refmap = dict(self.refmap)
+        # update the map in place: lazy blocks (see LazyInlines) use it
+        self.refmap.clear()
+        self.refdefs = []
+        for line, label, ref in refdefs:
+            self.add_reference(line, label, ref)
+
+        # Parse the top-level blocks that use changed labels again.
+        stale = []
+        for label in changed:
+            if old_refmap.get(label) == self.refmap.get(label):
+                continue
+            for leaf in self.label_uses.pop(label, ()):
+                top = top_level_block(leaf, doc)
+                if top is not None and top not in stale:
+                    stale.append(top)
+        # Last first, so that a block parsed again along with the List
+        # before it (see starts_like_document) is only parsed once.
+        stale.sort(key=lambda top: top.sourcepos[0][0], reverse=True)
+        for top in stale:
+            if top.parent is not doc:
+                continue
+            first = top
+            line = top.sourcepos[0][0]
+            offset = seek_line(new_source, region_offset, region_start, line)
+            while not starts_like_document(
+                    next(iter_lines(new_source, offset), ''), first.prv):
+                first = first.prv
+                offset = seek_line(
+                    new_source, offset, line, first.sourcepos[0][0])
+                line = first.sourcepos[0][0]
+            q = Parser(self.options)
+            q.line_number = line - 1
+            q.refmap = self.refmap
+            lines = iter_lines(new_source, offset)
+            while q.line_number < top.sourcepos[1][0]:
+                q.incorporate_line(next(lines))
+            while q.tip:
+                q.finalize(q.tip, q.line_number)
+            b = q.doc.first_child
+            while b:
+                new_blocks.append(b)
+                nxt = b.nxt
+                first.insert_before(b)
+                b = nxt
+            while first is not top:
+                nxt = first.nxt
+                first.unlink()
+                first = nxt
+            top.unlink()
+        if stale:
+            self.top_blocks = None
+
+        # Finally, parse inlines in the new blocks only, without a
+        # process pool: starting one costs far more than the few blocks
+        # an edit touches.  Uses by blocks that are gone are dropped
+        # once as many new uses have been added since the last time, to
+        # keep the cost linear.
+        label_uses = self.label_uses
+        self.label_uses = {}
+        for b in new_blocks:
+            self.process_inlines(b, parallel=False)
+        for label, uses in self.label_uses.items():
+            label_uses.setdefault(label, []).extend(uses)
+            self.label_uses_added += len(uses)
+        self.label_uses = label_uses
+        if self.label_uses_added > self.label_uses_kept:
+            self.label_uses_kept = 0
+            for label in list(label_uses):
+                uses = [leaf for leaf in label_uses[label]
+                        if top_level_block(leaf, doc) is not None]
+                if uses:
+                    label_uses[label] = uses
+                    self.label_uses_kept += len(uses)
+                else:
+                    del label_uses[label]
+            self.label_uses_added = 0
+        return doc
+
+    def parse_lines(self, lines):
+        """
+        Parse a document from an iterable of lines, such as a text file,
+        and return its AST.  Lines ending in a single LF go straight to
+        incorporate_line; anything else (CR or CRLF endings, lines
+        without endings, arbitrary chunks of text) goes through feed.
+        """
+        self.reset()
+        for line in lines:
+            if not line:
+                # find would report the missing LF as a final one
+                continue
+            if not self.partial_chunks and \
+               line.find('\n') == len(line) - 1 and '\r' not in line:
+                self.incorporate_line(line[:-1])
+            else:
+                self.feed(line)
+        return self.finish()
+
+    def parse_file(self, fp, encoding='utf-8', use_mmap=False):
+        """
+        Parse a document from the file object fp, line by line, and
+        return its AST.  Files opened in binary mode are decoded with
+        encoding.  If use_mmap is true, fp must be a real file and its
+        contents are read through a read-only memory map instead.
+        """
+        if not use_mmap:
+            return self.parse_lines(decode_chunks(fp, encoding))
+        if os.fstat(fp.fileno()).st_size == 0:
+            # empty files can't be mapped
+            return self.parse_lines([])
+        m = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return self.parse_lines(
+                decode_chunks(iter(m.readline, b''), encoding))
+        finally:
+            m.close()
@@ -8,16 +8,10 @@ try:
 except ImportError:
     from urllib import quote
 
+from CommonMark import entitytrans
+
 if sys.version_info >= (3, 0):
-    if sys.version_info >= (3, 4):
-        import html.parser
-        HTMLunescape = html.parser.HTMLParser().unescape
-    else:
-        from .entitytrans import _unescape
-        HTMLunescape = _unescape
-else:
-    from CommonMark import entitytrans
-    HTMLunescape = entitytrans._unescape
+    unichr = chr
 
 ENTITY = '&(?:#x[a-f0-9]{1,8}|#[0-9]{1,8}|[a-z][a-z0-9]{1,31});'
 
@@ -39,6 +33,14 @@ CDATA = '<!\\[CDATA\\[[\\s\\S]*?\\]\\]>'
 HTMLTAG = "(?:" + OPENTAG + "|" + CLOSETAG + "|" + HTMLCOMMENT + "|" + \
     PROCESSINGINSTRUCTION + "|" + DECLARATION + "|" + CDATA + ")"
 reHtmlTag = re.compile('^' + HTMLTAG, re.IGNORECASE)
+# The constructs in HTMLTAG, each on its own, so that the inline parser
+# can try just the one that the characters after '<' allow.
+reOpenTag = re.compile(OPENTAG, re.IGNORECASE)
+reCloseTag = re.compile(CLOSETAG, re.IGNORECASE)
+reHtmlComment = re.compile(HTMLCOMMENT)
+reProcessingInstruction = re.compile(PROCESSINGINSTRUCTION)
+reDeclaration = re.compile(DECLARATION, re.IGNORECASE)
+reCdata = re.compile(CDATA, re.IGNORECASE)
 reBackslashOrAmp = re.compile(r'[\\&]')
 ESCAPABLE = '[!"#$%&\'()*+,./:;<=>?@[\\\\\\]^_`{|}~-]'
 reEntityOrEscapedChar = re.compile(
@@ -48,11 +50,50 @@ reXmlSpecial = re.compile(XMLSPECIAL)
 reXmlSpecialOrEntity = re.compile(ENTITY + '|' + XMLSPECIAL, re.IGNORECASE)
 
 
+# Maps each HTML5 named entity, '&' and ';' included, to its text.
+named_entities = dict(
+    ('&' + name, value) for name, value in entitytrans._html5.items()
+    if name.endswith(';'))
+# Numeric entities decoded so far, to their text (see decode_entity).
+numeric_entities = {}
+
+
+def decode_entity(s):
+    """
+    Return the text of an entity as matched by ENTITY: '&name;',
+    '&#nnn;' or '&#xhhh;'.  A name that is not an HTML5 entity is
+    returned unchanged.
+    """
+    value = named_entities.get(s)
+    if value is not None:
+        return value
+    if s[1] != '#':
+        return s
+    value = numeric_entities.get(s)
+    if value is None:
+        if s[2] == 'x' or s[2] == 'X':
+            num = int(s[3:-1], 16)
+        else:
+            num = int(s[2:-1])
+        if num in entitytrans._invalid_charrefs:
+            value = entitytrans._invalid_charrefs[num]
+        elif 0xD800 <= num <= 0xDFFF or num > 0x10FFFF:
+            value = '\uFFFD'
+        elif num in entitytrans._invalid_codepoints:
+            value = ''
+        else:
+            value = unichr(num)
+        if len(numeric_entities) >= 4096:
+            numeric_entities.clear()
+        numeric_entities[s] = value
+    return value
+
+
 def unescape_char(s):
     if s[0] == '\\':
         return s[1]
     else:
-        return HTMLunescape(s)
+        return decode_entity(s)
 
 
 def unescape_string(s):
@@ -3,6 +3,7 @@ from __future__ import absolute_import, unicode_literals
 import re
 from builtins import str
 from CommonMark.common import escape_xml
+from CommonMark.node import LIST
 
 
 reHtmlTag = re.compile(r'\<[^>]*\>')
@@ -50,169 +51,192 @@ class HtmlRenderer:
             self.buf += '\n'
             self.last_out = '\n'
 
+    def attrs(self, node):
+        """The attributes of the tag for a block node."""
+        attrs = []
+        if self.options.get('sourcepos'):
+            pos = node.sourcepos
+            if pos:
+                attrs.append([
+                    'data-sourcepos',
+                    '{0}:{1}-{2}:{3}'.format(
+                        pos[0][0], pos[0][1], pos[1][0], pos[1][1])])
+        return attrs
+
+    # The method that renders each type of node, by type code
+    node_renderers = [
+        'document', 'block_quote', 'list', 'item', 'paragraph', 'heading',
+        'code_block', 'html_block', 'thematic_break', 'custom_block',
+        'text', 'soft_break', 'hard_break', 'emph', 'strong', 'link', 'image',
+        'code', 'html_inline', 'custom_inline']
+
     def renderNodes(self, block):
-        walker = block.walker()
         self.buf = ''
         self.last_out = '\n'
         self.disable_tags = 0
 
-        event = walker.nxt()
-        while event is not None:
-            entering = event['entering']
-            node = event['node']
-
-            attrs = []
-            if self.options.get('sourcepos'):
-                pos = node.sourcepos
-                if pos:
-                    attrs.push([
-                        'data-sourcepos',
-                        pos[0][0] + ':' + pos[0][1] + '-' +
-                        pos[1][0] + ':' + pos[1][1]])
-
-            if node.t == 'Text':
-                self.out(escape_xml(node.literal, False))
-            elif node.t == 'Softbreak':
-                self.out(self.softbreak)
-            elif node.t == 'Hardbreak':
-                self.out(tag('br', [], True))
-                self.cr()
-            elif node.t == 'Emph':
-                self.out(tag('em' if entering else '/em'))
-            elif node.t == 'Strong':
-                self.out(tag('strong' if entering else '/strong'))
-            elif node.t == 'HtmlInline':
-                if self.options.get('safe'):
-                    self.out('<!-- raw HTML omitted -->')
-                else:
-                    self.out(node.literal)
-            elif node.t == 'CustomInline':
-                if entering and node.on_enter:
-                    self.out(node.on_enter)
-                elif not entering and node.on_exit:
-                    self.out(node.on_exit)
-            elif node.t == 'Link':
-                if entering:
-                    if not (self.options.get('safe') and
-                            potentially_unsafe(node.destination)):
-                        attrs.append([
-                            'href',
-                            escape_xml(node.destination, True)
-                        ])
-                    if node.title:
-                        attrs.append(['title', escape_xml(node.title, True)])
-                    self.out(tag('a', attrs))
-                else:
-                    self.out(tag('/a'))
-            elif node.t == 'Image':
-                if entering:
-                    if self.disable_tags == 0:
-                        if self.options.get('safe') and \
-                           potentially_unsafe(node.destination):
-                            self.out('<img src="" alt="')
-                        else:
-                            self.out(
-                                '<img src="{0}" alt="'.format(
-                                    escape_xml(node.destination, True)))
-                    self.disable_tags += 1
-                else:
-                    self.disable_tags -= 1
-                    if self.disable_tags == 0:
-                        if node.title:
-                            self.out('" title="' +
-                                     escape_xml(node.title, True))
-                        self.out('" />')
-            elif node.t == 'Code':
-                self.out(
-                    tag('code') +
-                    escape_xml(node.literal, False) +
-                    tag('/code'))
-            elif node.t == 'Document':
-                pass
-            elif node.t == 'Paragraph':
-                grandparent = node.parent.parent
-                if grandparent is not None and \
-                   grandparent.t == 'List' and \
-                   grandparent.list_data.get('tight'):
-                    pass
-                else:
-                    if entering:
-                        self.cr()
-                        self.out(tag('p', attrs))
-                    else:
-                        self.out(tag('/p'))
-                        self.cr()
-            elif node.t == 'BlockQuote':
-                if entering:
-                    self.cr()
-                    self.out(tag('blockquote', attrs))
-                    self.cr()
-                else:
-                    self.cr()
-                    self.out(tag('/blockquote'))
-                    self.cr()
-            elif node.t == 'Item':
-                if entering:
-                    self.out(tag('li', attrs))
-                else:
-                    self.out(tag('/li'))
-                    self.cr()
-            elif node.t == 'List':
-                tagname = 'ul' if node.list_data['type'] == 'Bullet' else 'ol'
-                if entering:
-                    try:
-                        start = node.list_data['start']
-                    except KeyError:
-                        start = None
-                    if start is not None and start != 1:
-                        attrs.append(['start', str(start)])
-                    self.cr()
-                    self.out(tag(tagname, attrs))
-                    self.cr()
-                else:
-                    self.cr()
-                    self.out(tag('/' + tagname))
-                    self.cr()
-            elif node.t == 'Heading':
-                tagname = 'h' + str(node.level)
-                if entering:
-                    self.cr()
-                    self.out(tag(tagname, attrs))
-                else:
-                    self.out(tag('/' + tagname))
-                    self.cr()
-            elif node.t == 'CodeBlock':
-                info_words = re.split(r'\s+', node.info) if node.info else []
-                if len(info_words) > 0 and len(info_words[0]) > 0:
-                    attrs.append([
-                        'class',
-                        'language-' + escape_xml(info_words[0], True)
-                    ])
-                self.cr()
-                self.out(tag('pre') + tag('code', attrs))
-                self.out(escape_xml(node.literal, False))
-                self.out(tag('/code') + tag('/pre'))
-                self.cr()
-            elif node.t == 'HtmlBlock':
-                if self.options.get('safe'):
-                    self.out('<!-- raw HTML omitted -->')
-                else:
-                    self.out(str(node.literal))
-                self.cr()
-            elif node.t == 'CustomBlock':
-                self.cr()
-                if entering and node.on_enter:
-                    self.out(node.on_enter)
-                elif not entering and node.on_exit:
-                    self.out(node.on_exit)
-                self.cr()
-            elif node.t == 'ThematicBreak':
-                self.cr()
-                self.out(tag('hr', attrs, True))
-                self.cr()
-            else:
+        renderers = [getattr(self, name) for name in self.node_renderers]
+        for node, entering in block.walk():
+            try:
+                render = renderers[node.type_code]
+            except IndexError:
                 raise ValueError('Unknown node type {0}'.format(node.t))
-            event = walker.nxt()
+            render(node, entering)
         return self.buf
 
     render = renderNodes
+
+    def text(self, node, entering):
+        self.out(escape_xml(node.literal, False))
+
+    def soft_break(self, node, entering):
+        self.out(self.softbreak)
+
+    def hard_break(self, node, entering):
+        self.out(tag('br', [], True))
+        self.cr()
+
+    def emph(self, node, entering):
+        self.out(tag('em' if entering else '/em'))
+
+    def strong(self, node, entering):
+        self.out(tag('strong' if entering else '/strong'))
+
+    def html_inline(self, node, entering):
+        if self.options.get('safe'):
+            self.out('<!-- raw HTML omitted -->')
+        else:
+            self.out(node.literal)
+
+    def custom_inline(self, node, entering):
+        if entering and node.on_enter:
+            self.out(node.on_enter)
+        elif not entering and node.on_exit:
+            self.out(node.on_exit)
+
+    def link(self, node, entering):
+        if entering:
+            attrs = []
+            if not (self.options.get('safe') and
+                    potentially_unsafe(node.destination)):
+                attrs.append(['href', escape_xml(node.destination, True)])
+            if node.title:
+                attrs.append(['title', escape_xml(node.title, True)])
+            self.out(tag('a', attrs))
+        else:
+            self.out(tag('/a'))
+
+    def image(self, node, entering):
+        if entering:
+            if self.disable_tags == 0:
+                if self.options.get('safe') and \
+                   potentially_unsafe(node.destination):
+                    self.out('<img src="" alt="')
+                else:
+                    self.out(
+                        '<img src="{0}" alt="'.format(
+                            escape_xml(node.destination, True)))
+            self.disable_tags += 1
+        else:
+            self.disable_tags -= 1
+            if self.disable_tags == 0:
+                if node.title:
+                    self.out('" title="' + escape_xml(node.title, True))
+                self.out('" />')
+
+    def code(self, node, entering):
+        self.out(
+            tag('code') +
+            escape_xml(node.literal, False) +
+            tag('/code'))
+
+    def document(self, node, entering):
+        pass
+
+    def paragraph(self, node, entering):
+        grandparent = node.parent.parent
+        if grandparent is not None and \
+           grandparent.type_code == LIST and \
+           grandparent.list_data.tight:
+            return
+        if entering:
+            self.cr()
+            self.out(tag('p', self.attrs(node)))
+        else:
+            self.out(tag('/p'))
+            self.cr()
+
+    def block_quote(self, node, entering):
+        if entering:
+            self.cr()
+            self.out(tag('blockquote', self.attrs(node)))
+            self.cr()
+        else:
+            self.cr()
+            self.out(tag('/blockquote'))
+            self.cr()
+
+    def item(self, node, entering):
+        if entering:
+            self.out(tag('li', self.attrs(node)))
+        else:
+            self.out(tag('/li'))
+            self.cr()
+
+    def list(self, node, entering):
+        tagname = 'ul' if node.list_data.type == 'Bullet' else 'ol'
+        if entering:
+            attrs = self.attrs(node)
+            start = node.list_data.start
+            if start is not None and start != 1:
+                attrs.append(['start', str(start)])
+            self.cr()
+            self.out(tag(tagname, attrs))
+            self.cr()
+        else:
+            self.cr()
+            self.out(tag('/' + tagname))
+            self.cr()
+
+    def heading(self, node, entering):
+        tagname = 'h' + str(node.level)
+        if entering:
+            self.cr()
+            self.out(tag(tagname, self.attrs(node)))
+        else:
+            self.out(tag('/' + tagname))
+            self.cr()
+
+    def code_block(self, node, entering):
+        attrs = self.attrs(node)
+        info_words = re.split(r'\s+', node.info) if node.info else []
+        if len(info_words) > 0 and len(info_words[0]) > 0:
+            attrs.append([
+                'class',
+                'language-' + escape_xml(info_words[0], True)
+            ])
+        self.cr()
+        self.out(tag('pre') + tag('code', attrs))
+        self.out(escape_xml(node.literal, False))
+        self.out(tag('/code') + tag('/pre'))
+        self.cr()
+
+    def html_block(self, node, entering):
+        if self.options.get('safe'):
+            self.out('<!-- raw HTML omitted -->')
+        else:
+            self.out(str(node.literal))
+        self.cr()
+
+    def custom_block(self, node, entering):
+        self.cr()
+        if entering and node.on_enter:
+            self.out(node.on_enter)
+        elif not entering and node.on_exit:
+            self.out(node.on_exit)
+        self.cr()
+
+    def thematic_break(self, node, entering):
+        self.cr()
+        self.out(tag('hr', self.attrs(node), True))
+        self.cr()
@@ -1,68 +1,70 @@
 from __future__ import absolute_import, unicode_literals
 
 import re
-import sys
+from bisect import bisect_left
 from CommonMark import common
-from CommonMark.common import normalize_uri, unescape_string
-from CommonMark.node import Node
+from CommonMark.common import decode_entity, normalize_uri, unescape_string
+from CommonMark.node import CONTAINER_CODES, NODE_TYPES, TEXT, Node
 
-if sys.version_info >= (3, 0):
-    if sys.version_info >= (3, 4):
-        import html.parser
-        HTMLunescape = html.parser.HTMLParser().unescape
-    else:
-        from .entitytrans import _unescape
-        HTMLunescape = _unescape
-else:
-    from CommonMark import entitytrans
-    HTMLunescape = entitytrans._unescape
-
-# Some regexps used in inline parser:
+# Some regexps used in inline parser.  Most are matched at the current
+# position with pattern.match(subject, pos) (see InlineParser.match), so
+# they have no '^' anchor.
 
 ESCAPED_CHAR = '\\\\' + common.ESCAPABLE
 REG_CHAR = '[^\\\\()\\x00-\\x20]'
 IN_PARENS_NOSP = '\\((' + REG_CHAR + '|' + ESCAPED_CHAR + '|\\\\)*\\)'
 
 rePunctuation = re.compile(
-    r'^[\u2000-\u206F\u2E00-\u2E7F\\' + "'" + '!"#\$%&\(\)'
+    r'[\u2000-\u206F\u2E00-\u2E7F\\' + "'" + '!"#\$%&\(\)'
     r'\*\+,\-\.\/:;<=>\?@\[\]\^_`\{\|\}~]')
 
 reLinkTitle = re.compile(
-    '^(?:"(' + ESCAPED_CHAR + '|[^"\\x00])*"' +
+    '(?:"(' + ESCAPED_CHAR + '|[^"\\x00])*"' +
     '|' +
     '\'(' + ESCAPED_CHAR + '|[^\'\\x00])*\'' +
     '|' +
     '\\((' + ESCAPED_CHAR + '|[^)\\x00])*\\))')
 reLinkDestinationBraces = re.compile(
-    '^(?:[<](?:[^ <>\\t\\n\\\\\\x00]' + '|' + ESCAPED_CHAR + '|' +
+    '(?:[<](?:[^ <>\\t\\n\\\\\\x00]' + '|' + ESCAPED_CHAR + '|' +
     '\\\\)*[>])')
 reLinkDestination = re.compile(
-    '^(?:' + REG_CHAR + '+|' + ESCAPED_CHAR + '|\\\\|' +
+    '(?:' + REG_CHAR + '+|' + ESCAPED_CHAR + '|\\\\|' +
     IN_PARENS_NOSP + ')*')
 
-reEscapable = re.compile('^' + common.ESCAPABLE)
-reEntityHere = re.compile('^' + common.ENTITY, re.IGNORECASE)
+reEscapable = re.compile(common.ESCAPABLE)
+reEntityHere = re.compile(common.ENTITY, re.IGNORECASE)
 reTicks = re.compile(r'`+')
-reTicksHere = re.compile(r'^`+')
 reEllipses = re.compile(r'\.\.\.')
 reDash = re.compile(r'--+')
 reEmailAutolink = re.compile(
-    r"^<([a-zA-Z0-9.!#$%&'*+\/=?^_`{|}~-]+@[a-zA-Z0-9]"
+    r"<([a-zA-Z0-9.!#$%&'*+\/=?^_`{|}~-]+@[a-zA-Z0-9]"
     r"(?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?"
     r"(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*)>")
 reAutolink = re.compile(
-    r'^<[A-Za-z][A-Za-z0-9.+-]{1,31}:[^<>\x00-\x20]*>',
+    r'<[A-Za-z][A-Za-z0-9.+-]{1,31}:[^<>\x00-\x20]*>',
     re.IGNORECASE)
-reSpnl = re.compile(r'^ *(?:\n *)?')
-reWhitespaceChar = re.compile(r'^\s')
+# Characters that can follow '<' in an email autolink, and in a URL
+# autolink or HTML tag.
+EMAIL_START_CHARS = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+    ".!#$%&'*+/=?^_`{|}~-")
+LETTERS = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
+reSpnl = re.compile(r' *(?:\n *)?')
+reWhitespaceChar = re.compile(r'\s')
 reWhitespace = re.compile(r'\s+')
 reFinalSpace = re.compile(r' *$')
-reInitialSpace = re.compile(r'^ *')
-reSpaceAtEndOfLine = re.compile(r'^ *(?:\n|$)')
-reLinkLabel = re.compile('^\\[(?:[^\\\\\\[\\]]|' + ESCAPED_CHAR +
+reInitialSpace = re.compile(r' *')
+reSpaceAtEndOfLine = re.compile(r' *(?:\n|$)')
+reLinkLabel = re.compile('\\[(?:[^\\\\\\[\\]]|' + ESCAPED_CHAR +
                          '|\\\\){0,1000}\\]')
 # Matches a string of non-special characters.
-reMain = re.compile(r'^[^\n`\[\]\\!<&*_\'"]+', re.MULTILINE)
+reMain = re.compile(r'[^\n`\[\]\\!<&*_\'"]+')
+# The same, but stopping before any ellipsis or run of dashes, which the
+# 'smart' option turns into punctuation.
+reMainSmart = re.compile(
+    r'(?:[^\n`\[\]\\!<&*_\'".-]+|\.(?!\.\.)|-(?!-))+')
+reEmptyLinkLabel = re.compile(r'\[\s+\]')
 
 
 def normalizeReference(s):
@@ -71,7 +73,7 @@ def normalizeReference(s):
     Collapse internal whitespace to single space, remove
     leading/trailing whitespace, case fold.
     """
-    return re.sub(r'\s+', ' ', s.strip()).upper()
+    return reWhitespace.sub(' ', s.strip()).upper()
 
 
 def text(s):
@@ -80,27 +82,117 @@ def text(s):
     return node
 
 
+def merge_text_nodes(block):
+    """
+    Merge each run of adjacent Text nodes among the inline descendants
+    of block into one node.
+    """
+    containers = [block]
+    while containers:
+        child = containers.pop().first_child
+        while child is not None:
+            nxt = child.nxt
+            if child.type_code == TEXT:
+                if nxt is not None and nxt.type_code == TEXT:
+                    parts = [child.literal]
+                    while nxt is not None and nxt.type_code == TEXT:
+                        parts.append(nxt.literal)
+                        nxt.unlink()
+                        nxt = child.nxt
+                    child.literal = ''.join(parts)
+            elif child.first_child is not None:
+                containers.append(child)
+            child = nxt
+
+
 def smart_dashes(chars):
     en_count = 0
     em_count = 0
     if len(chars) % 3 == 0:
         # If divisible by 3, use all em dashes
-        em_count = len(chars) / 3
+        em_count = len(chars) // 3
     elif len(chars) % 2 == 0:
         # If divisble by 2, use all en dashes
-        en_count = len(chars) / 2
+        en_count = len(chars) // 2
     elif len(chars) % 3 == 2:
         # if 2 extra dashes, use en dashfor last 2;
         # em dashes for rest
         en_count = 1
-        em_count = (len(chars) - 2) / 3
+        em_count = (len(chars) - 2) // 3
     else:
         # Use en dashes for last 4 hyphens; em dashes for rest
         en_count = 2
-        em_count = (len(chars) - 4) / 3
+        em_count = (len(chars) - 4) // 3
     return ('\u2014' * em_count) + ('\u2013' * en_count)
 
 
+# Maps characters to (is_whitespace, is_punctuation) for the flanking
+# rules in scanDelims.  ASCII is filled in here, other characters the
+# first time classify_flanking_char sees them.
+flanking_classes = {}
+
+
+def classify_flanking_char(c):
+    """
+    Return a tuple of whether c counts as whitespace and whether it
+    counts as punctuation when deciding if a delimiter run is left- or
+    right-flanking, and remember the answer in flanking_classes.
+    """
+    # Python 2 doesn't recognize '\xa0' as whitespace
+    cls = (reWhitespaceChar.match(c) is not None or c == '\xa0',
+           rePunctuation.match(c) is not None)
+    flanking_classes[c] = cls
+    return cls
+
+
+for i in range(128):
+    classify_flanking_char('%c' % i)
+
+
+class Delimiter(object):
+    """
+    An entry in the delimiter stack: a run of emphasis or quote
+    characters (cc is '*', '_', "'" or '"').  The stack is a doubly
+    linked list through previous and next; creating an entry pushes it
+    on top of previous.
+    """
+    __slots__ = ('cc', 'numdelims', 'node', 'previous', 'next',
+                 'can_open', 'can_close')
+
+    def __init__(self, cc, numdelims, node, previous, can_open, can_close):
+        self.cc = cc
+        self.numdelims = numdelims
+        self.node = node
+        self.previous = previous
+        self.next = None
+        self.can_open = can_open
+        self.can_close = can_close
+        if previous is not None:
+            previous.next = self
+
+
+class Bracket(object):
+    """
+    An entry in the bracket stack: a link opener '[' or, if image is
+    True, an image opener '!['.  index is the position of the '[' in
+    the subject, and previous_delimiter the top of the delimiter stack
+    when the opener was seen.  A link opener is only active while no
+    link has been closed since; the parser counts closed links in
+    link_generation, and the opener records the count it saw.
+    """
+    __slots__ = ('node', 'previous', 'previous_delimiter', 'index',
+                 'image', 'generation')
+
+    def __init__(self, node, previous, previous_delimiter, index, image,
+                 generation):
+        self.node = node
+        self.previous = previous
+        self.previous_delimiter = previous_delimiter
+        self.index = index
+        self.image = image
+        self.generation = generation
+
+
 class InlineParser:
     """INLINE PARSER
 
@@ -112,19 +204,26 @@ class InlineParser:
     def __init__(self, options={}):
         self.subject = ''
         self.pos = 0
+        # runs of backticks in subject (see parseBackticks)
+        self.backtick_runs = None
         self.refmap = {}
+        # if not None, maps each reference label looked up to the
+        # blocks that used it (see Parser.reparse)
+        self.label_uses = None
+        # number of links closed so far (see Bracket)
+        self.link_generation = 0
         self.options = options
 
-    def match(self, regexString):
+    def match(self, regex):
         """
-        If regexString matches at current position in the subject, advance
+        If regex matches at current position in the subject, advance
         position in subject and return the match; otherwise return None.
         """
-        match = re.search(regexString, self.subject[self.pos:])
+        match = regex.match(self.subject, self.pos)
         if match is None:
             return None
         else:
-            self.pos += match.end()
+            self.pos = match.end()
             return match.group()
 
     def peek(self):
@@ -148,21 +247,32 @@ class InlineParser:
     def parseBackticks(self, block):
         """ Attempt to parse backticks, adding either a backtick code span or a
         literal sequence of backticks to the 'inlines' list."""
-        ticks = self.match(reTicksHere)
+        ticks = self.match(reTicks)
         if ticks is None:
             return False
         after_open_ticks = self.pos
-        matched = self.match(reTicks)
-        while matched is not None:
-            if (matched == ticks):
-                node = Node('Code', None)
-                c = self.subject[after_open_ticks:self.pos - len(ticks)]
-                c = c.strip()
-                c = re.sub(reWhitespace, ' ', c)
-                node.literal = c
-                block.append_child(node)
-                return True
-            matched = self.match(reTicks)
+        if self.backtick_runs is None:
+            # index the start of every run of backticks in the subject
+            # by its length, so that an opener without a closer doesn't
+            # have to search the rest of the subject for one
+            self.backtick_runs = {}
+            for m in reTicks.finditer(self.subject):
+                self.backtick_runs.setdefault(
+                    m.end() - m.start(), []).append(m.start())
+        # (after a backslash escape, the opener may be the tail of a
+        # longer run, and so not be indexed itself)
+        starts = self.backtick_runs.get(len(ticks), [])
+        i = bisect_left(starts, after_open_ticks)
+        if i < len(starts):
+            closer = starts[i]
+            self.pos = closer + len(ticks)
+            node = Node('Code', None)
+            c = self.subject[after_open_ticks:closer]
+            c = c.strip()
+            c = reWhitespace.sub(' ', c)
+            node.literal = c
+            block.append_child(node)
+            return True
         # If we got here, we didn't match a closing backtick sequence.
         self.pos = after_open_ticks
         block.append_child(text(ticks))
@@ -187,7 +297,7 @@ class InlineParser:
             self.pos += 1
             node = Node('Hardbreak', None)
             block.append_child(node)
-        elif subjchar and re.match(reEscapable, subjchar):
+        elif subjchar and reEscapable.match(subjchar):
             block.append_child(text(subjchar))
             self.pos += 1
         else:
@@ -197,7 +307,8 @@ class InlineParser:
 
     def parseAutolink(self, block):
         """Attempt to parse an autolink (URL or email in pointy brackets)."""
-        m = self.match(reEmailAutolink)
+        c = self.subject[self.pos + 1:self.pos + 2]
+        m = c in EMAIL_START_CHARS and self.match(reEmailAutolink)
 
         if m:
             # email
@@ -208,7 +319,7 @@ class InlineParser:
             node.append_child(text(dest))
             block.append_child(node)
             return True
-        else:
+        elif c in LETTERS:
             m = self.match(reAutolink)
             if m:
                 # link
@@ -224,7 +335,26 @@ class InlineParser:
 
     def parseHtmlTag(self, block):
         """Attempt to parse a raw HTML tag."""
-        m = self.match(common.reHtmlTag)
+        # only try the construct that can start with what follows '<'
+        c = self.subject[self.pos + 1:self.pos + 2]
+        if c in LETTERS:
+            m = self.match(common.reOpenTag)
+        elif c == '/':
+            m = self.match(common.reCloseTag)
+        elif c == '?':
+            m = self.match(common.reProcessingInstruction)
+        elif c == '!':
+            c = self.subject[self.pos + 2:self.pos + 3]
+            if c == '-':
+                m = self.match(common.reHtmlComment)
+            elif c == '[':
+                m = self.match(common.reCdata)
+            elif c in LETTERS:
+                m = self.match(common.reDeclaration)
+            else:
+                m = None
+        else:
+            m = None
         if m is None:
             return False
         else:
@@ -235,10 +365,10 @@ class InlineParser:
 
     def scanDelims(self, c):
         """
-        Scan a sequence of characters == c, and return information about
-        the number of delimiters and whether they are positioned such that
-        they can open and/or close emphasis or strong emphasis.  A utility
-        function for strong/emph parsing.
+        Scan a sequence of characters == c, and return a tuple of the
+        number of delimiters and whether they are positioned such that
+        they can open and/or close emphasis or strong emphasis, or None.
+        A utility function for strong/emph parsing.
         """
         numdelims = 0
         startpos = self.pos
@@ -260,13 +390,10 @@ class InlineParser:
         if c_after is None:
             c_after = '\n'
 
-        # Python 2 doesn't recognize '\xa0' as whitespace
-        after_is_whitespace = re.match(reWhitespaceChar, c_after) or \
-            c_after == '\xa0'
-        after_is_punctuation = re.match(rePunctuation, c_after)
-        before_is_whitespace = re.match(reWhitespaceChar, c_before) or \
-            c_before == '\xa0'
-        before_is_punctuation = re.match(rePunctuation, c_before)
+        before_is_whitespace, before_is_punctuation = \
+            flanking_classes.get(c_before) or classify_flanking_char(c_before)
+        after_is_whitespace, after_is_punctuation = \
+            flanking_classes.get(c_after) or classify_flanking_char(c_after)
 
         left_flanking = not after_is_whitespace and \
             not (after_is_punctuation and
@@ -289,18 +416,14 @@ class InlineParser:
             can_close = right_flanking
 
         self.pos = startpos
-        return {
-            'numdelims': numdelims,
-            'can_open': can_open,
-            'can_close': can_close,
-        }
+        return numdelims, can_open, can_close
 
     def handleDelim(self, cc, block):
         """Handle a delimiter marker for emphasis or a quote."""
         res = self.scanDelims(cc)
         if not res:
             return False
-        numdelims = res.get('numdelims')
+        numdelims, can_open, can_close = res
         startpos = self.pos
 
         self.pos += numdelims
@@ -314,34 +437,24 @@ class InlineParser:
         block.append_child(node)
 
         # Add entry to stack for this opener
-        self.delimiters = {
-            'cc': cc,
-            'numdelims': numdelims,
-            'node': node,
-            'previous': self.delimiters,
-            'next': None,
-            'can_open': res.get('can_open'),
-            'can_close': res.get('can_close'),
-            'active': True,
-        }
-        if self.delimiters['previous'] is not None:
-            self.delimiters['previous']['next'] = self.delimiters
+        self.delimiters = Delimiter(cc, numdelims, node, self.delimiters,
+                                    can_open, can_close)
         return True
 
     def removeDelimiter(self, delim):
-        if delim.get('previous') is not None:
-            delim['previous']['next'] = delim.get('next')
-        if delim.get('next') is None:
+        if delim.previous is not None:
+            delim.previous.next = delim.next
+        if delim.next is None:
             # Top of stack
-            self.delimiters = delim.get('previous')
+            self.delimiters = delim.previous
         else:
-            delim['next']['previous'] = delim.get('previous')
+            delim.next.previous = delim.previous
 
     @staticmethod
     def removeDelimitersBetween(bottom, top):
-        if bottom.get('next') != top:
-            bottom['next'] = top
-            top['previous'] = bottom
+        if bottom.next is not top:
+            bottom.next = top
+            top.previous = bottom
 
     def processEmphasis(self, stack_bottom):
         openers_bottom = {
@@ -354,54 +467,54 @@ class InlineParser:
 
         # Find first closer above stack_bottom
         closer = self.delimiters
-        while closer is not None and closer.get('previous') != stack_bottom:
-            closer = closer.get('previous')
+        while closer is not None and closer.previous is not stack_bottom:
+            closer = closer.previous
 
         # Move forward, looking for closers, and handling each
         while closer is not None:
-            closercc = closer.get('cc')
-            if not (closer.get('can_close') and
+            closercc = closer.cc
+            if not (closer.can_close and
                     (closercc == '_' or
                      closercc == '*' or
                      closercc == "'" or
                      closercc == '"')):
-                closer = closer.get('next')
+                closer = closer.next
             else:
                 # found emphasis closer. now look back for first
                 # matching opener:
-                opener = closer.get('previous')
+                opener = closer.previous
                 opener_found = False
-                while (opener is not None and opener != stack_bottom and
-                       opener != openers_bottom[closercc]):
-                    if opener.get('cc') == closercc and opener.get('can_open'):
+                while (opener is not None and opener is not stack_bottom and
+                       opener is not openers_bottom[closercc]):
+                    if opener.cc == closercc and opener.can_open:
                         opener_found = True
                         break
-                    opener = opener.get('previous')
+                    opener = opener.previous
                 old_closer = closer
 
                 if closercc == '*' or closercc == '_':
                     if not opener_found:
-                        closer = closer.get('next')
+                        closer = closer.next
                     else:
                         # Calculate actual number of delimiters used from
                         # closer
-                        if closer['numdelims'] < 3 or opener['numdelims'] < 3:
-                            if closer['numdelims'] <= opener['numdelims']:
-                                use_delims = closer['numdelims']
+                        if closer.numdelims < 3 or opener.numdelims < 3:
+                            if closer.numdelims <= opener.numdelims:
+                                use_delims = closer.numdelims
                             else:
-                                use_delims = opener['numdelims']
+                                use_delims = opener.numdelims
                         else:
-                            if closer['numdelims'] % 2 == 0:
+                            if closer.numdelims % 2 == 0:
                                 use_delims = 2
                             else:
                                 use_delims = 1
 
-                        opener_inl = opener.get('node')
-                        closer_inl = closer.get('node')
+                        opener_inl = opener.node
+                        closer_inl = closer.node
 
                         # Remove used delimiters from stack elts and inlines
-                        opener['numdelims'] -= use_delims
-                        closer['numdelims'] -= use_delims
+                        opener.numdelims -= use_delims
+                        closer.numdelims -= use_delims
                         opener_inl.literal = opener_inl.literal[
                             :len(opener_inl.literal) - use_delims]
                         closer_inl.literal = closer_inl.literal[
@@ -427,38 +540,45 @@ class InlineParser:
                         self.removeDelimitersBetween(opener, closer)
 
                         # If opener has 0 delims, remove it and the inline
-                        if opener['numdelims'] == 0:
+                        if opener.numdelims == 0:
                             opener_inl.unlink()
                             self.removeDelimiter(opener)
 
-                        if closer['numdelims'] == 0:
+                        if closer.numdelims == 0:
                             closer_inl.unlink()
-                            tempstack = closer['next']
+                            tempstack = closer.next
                             self.removeDelimiter(closer)
                             closer = tempstack
 
                 elif closercc == "'":
-                    closer['node'].literal = '\u2019'
+                    closer.node.literal = '\u2019'
                     if opener_found:
-                        opener['node'].literal = '\u2018'
-                    closer = closer['next']
+                        opener.node.literal = '\u2018'
+                    closer = closer.next
 
                 elif closercc == '"':
-                    closer['node'].literal = '\u201D'
+                    closer.node.literal = '\u201D'
                     if opener_found:
-                        opener['node'].literal = '\u201C'
-                    closer = closer['next']
+                        opener.node.literal = '\u201C'
+                    closer = closer.next
+
+                if opener_found and (closercc == "'" or closercc == '"'):
+                    # A quote that can close can't open, so this closer
+                    # is done with; leaving it on the stack would make
+                    # later closers search past it again.
+                    self.removeDelimiter(old_closer)
 
                 if not opener_found:
                     # Set lower bound for future searches for openers:
-                    openers_bottom[closercc] = old_closer['previous']
-                    if not old_closer['can_open']:
+                    openers_bottom[closercc] = old_closer.previous
+                    if not old_closer.can_open:
                         # We can remove a closer that can't be an opener,
                         # once we've seen there's no matching opener:
                         self.removeDelimiter(old_closer)
 
         # Remove all delimiters
-        while self.delimiters is not None and self.delimiters != stack_bottom:
+        while self.delimiters is not None and \
+                self.delimiters is not stack_bottom:
             self.removeDelimiter(self.delimiters)
 
     def parseLinkTitle(self):
@@ -495,14 +615,14 @@ class InlineParser:
         characters parsed.
         """
         m = self.match(reLinkLabel)
-        if m is None or len(m) > 1001 or re.match(r'\[\s+\]', m):
+        if m is None or len(m) > 1001 or reEmptyLinkLabel.match(m):
             return 0
         else:
             return len(m)
 
     def parseOpenBracket(self, block):
         """
-        Add open bracket to delimiter stack and add a text node to
+        Add open bracket to bracket stack and add a text node to
         block's children.
         """
         startpos = self.pos
@@ -512,25 +632,14 @@ class InlineParser:
         block.append_child(node)
 
         # Add entry to stack for this opener
-        self.delimiters = {
-            'cc': '[',
-            'numdelims': 1,
-            'node': node,
-            'previous': self.delimiters,
-            'next': None,
-            'can_open': True,
-            'can_close': False,
-            'index': startpos,
-            'active': True,
-        }
-        if self.delimiters.get('previous') is not None:
-            self.delimiters['previous']['next'] = self.delimiters
+        self.brackets = Bracket(node, self.brackets, self.delimiters,
+                                startpos, False, self.link_generation)
 
         return True
 
     def parseBang(self, block):
         """
-        If next character is [, and ! delimiter to delimiter stack and
+        If next character is [, and ! delimiter to bracket stack and
         add a text node to block's children. Otherwise just add a text
         node.
         """
@@ -542,20 +651,9 @@ class InlineParser:
             node = text('![')
             block.append_child(node)
 
-            # Add entry to stack for this openeer
-            self.delimiters = {
-                'cc': '!',
-                'numdelims': 1,
-                'node': node,
-                'previous': self.delimiters,
-                'next': None,
-                'can_open': True,
-                'can_close': False,
-                'index': startpos + 1,
-                'active': True,
-            }
-            if self.delimiters['previous'] is not None:
-                self.delimiters['previous']['next'] = self.delimiters
+            # Add entry to stack for this opener
+            self.brackets = Bracket(node, self.brackets, self.delimiters,
+                                    startpos + 1, True, self.link_generation)
         else:
             block.append_child(text('!'))
 
@@ -563,38 +661,33 @@ class InlineParser:
 
     def parseCloseBracket(self, block):
         """
-        Try to match close bracket against an opening in the delimiter
+        Try to match close bracket against an opening in the bracket
         stack. Add either a link or image, or a plain [ character,
-        to block's children. If there is a matching delimiter,
-        remove it from the delimiter stack.
+        to block's children. If there is a matching opener,
+        remove it from the bracket stack.
         """
         title = None
         matched = False
         self.pos += 1
         startpos = self.pos
 
-        # look through the stack of delimiters for a [ or ![
-        opener = self.delimiters
-
-        while opener is not None:
-            if opener.get('cc') == '[' or opener.get('cc') == '!':
-                break
-            opener = opener.get('previous')
+        # get last [ or ![
+        opener = self.brackets
 
         if opener is None:
             # no matched opener, just return a literal
             block.append_child(text(']'))
             return True
 
-        if not opener.get('active'):
+        if not opener.image and opener.generation != self.link_generation:
             # no matched opener, just return a literal
             block.append_child(text(']'))
-            # take opener off emphasis stack
-            self.removeDelimiter(opener)
+            # take opener off bracket stack
+            self.brackets = opener.previous
             return True
 
         # If we got here, opener is a potential opener
-        is_image = opener.get('cc') == '!'
+        is_image = opener.image
 
         # Check to see if we have a link/image
 
@@ -606,7 +699,7 @@ class InlineParser:
             if dest is not None and \
                self.spnl():
                 # make sure there's a space before the title
-                if re.match(reWhitespaceChar, self.subject[self.pos-1]):
+                if reWhitespaceChar.match(self.subject, self.pos - 1):
                     title = self.parseLinkTitle()
                 if self.spnl() and self.peek() == ')':
                     self.pos += 1
@@ -618,52 +711,61 @@ class InlineParser:
             n = self.parseLinkLabel()
             if n == 0 or n == 2:
                 # empty or missing second label
-                reflabel = self.subject[opener['index']:startpos]
+                if startpos - opener.index > 1001:
+                    # too long to be a label (see parseLinkLabel); don't
+                    # copy it, as nested brackets would make that
+                    # quadratic
+                    reflabel = None
+                else:
+                    reflabel = self.subject[opener.index:startpos]
             else:
                 reflabel = self.subject[beforelabel:beforelabel + n]
             if n == 0:
                 # If shortcut reference link, rewind before spaces we skipped.
                 self.pos = savepos
 
-            # lookup rawlabel in refmap
-            link = self.refmap.get(normalizeReference(reflabel))
-            if link:
-                dest = link['destination']
-                title = link['title']
-                matched = True
+            if reflabel is not None:
+                # lookup rawlabel in refmap
+                label = normalizeReference(reflabel)
+                if self.label_uses is not None:
+                    uses = self.label_uses.setdefault(label, [])
+                    if not uses or uses[-1] is not block:
+                        uses.append(block)
+                link = self.refmap.get(label)
+                if link:
+                    dest = link['destination']
+                    title = link['title']
+                    matched = True
 
         if matched:
             node = Node('Image' if is_image else 'Link', None)
 
             node.destination = dest
             node.title = title or ''
-            tmp = opener.get('node').nxt
+            tmp = opener.node.nxt
             while tmp:
                 nxt = tmp.nxt
                 tmp.unlink()
                 node.append_child(tmp)
                 tmp = nxt
             block.append_child(node)
-            self.processEmphasis(opener.get('previous'))
+            self.processEmphasis(opener.previous_delimiter)
+            self.brackets = opener.previous
 
-            opener.get('node').unlink()
+            opener.node.unlink()
 
-            # processEmphasis will remove this and later delimiters.
-            # Now, for a link, we also deactivate earlier link openers.
-            # (no links in links)
+            # We remove this opener from the bracket stack.  For a link,
+            # we also deactivate earlier link openers (no links in
+            # links): starting a new generation does that for all of
+            # them at once.
             if not is_image:
-                opener = self.delimiters
-                while opener is not None:
-                    if opener.get('cc') == '[':
-                        # deactivate this opener
-                        opener['active'] = False
-                    opener = opener.get('previous')
+                self.link_generation += 1
 
             return True
         else:
             # no match
             # remove this opener from stack
-            self.removeDelimiter(opener)
+            self.brackets = opener.previous
             self.pos = startpos
             block.append_child(text(']'))
             return True
@@ -672,7 +774,7 @@ class InlineParser:
         """Attempt to parse an entity."""
         m = self.match(reEntityHere)
         if m:
-            block.append_child(text(HTMLunescape(m)))
+            block.append_child(text(decode_entity(m)))
             return True
         else:
             return False
@@ -682,14 +784,21 @@ class InlineParser:
         Parse a run of ordinary characters, or a single character with
         a special meaning in markdown, as a plain string.
         """
+        if self.options.get('smart'):
+            m = self.match(reMainSmart)
+            if m:
+                block.append_child(text(m))
+            elif self.match(reEllipses):
+                block.append_child(text('\u2026'))
+            else:
+                m = self.match(reDash)
+                if m is None:
+                    return False
+                block.append_child(text(smart_dashes(m)))
+            return True
         m = self.match(reMain)
         if m:
-            if self.options.get('smart'):
-                s = re.sub(reEllipses, '\u2026', m)
-                s = re.sub(reDash, lambda x: smart_dashes(x.group()), s)
-                block.append_child(text(s))
-            else:
-                block.append_child(text(m))
+            block.append_child(text(m))
             return True
         else:
             return False
@@ -702,9 +811,9 @@ class InlineParser:
         # assume we're at a \n
         self.pos += 1
         lastc = block.last_child
-        if lastc and lastc.t == 'Text' and lastc.literal[-1] == ' ':
+        if lastc and lastc.type_code == TEXT and lastc.literal[-1] == ' ':
             hardbreak = len(lastc.literal) >= 2 and lastc.literal[-2] == ' '
-            lastc.literal = re.sub(reFinalSpace, '', lastc.literal)
+            lastc.literal = reFinalSpace.sub('', lastc.literal)
             if hardbreak:
                 node = Node('Hardbreak', None)
             else:
@@ -717,10 +826,13 @@ class InlineParser:
         self.match(reInitialSpace)
         return True
 
-    def parseReference(self, s, refmap):
-        """Attempt to parse a link reference, modifying refmap."""
+    def parseReference(self, s, refmap, pos=0):
+        """
+        Attempt to parse a link reference starting at pos in s, modifying
+        refmap.  Returns the number of characters parsed, or 0.
+        """
         self.subject = s
-        self.pos = 0
+        self.pos = pos
         startpos = self.pos
 
         # label:
@@ -728,7 +840,7 @@ class InlineParser:
         if match_chars == 0 or match_chars == 2:
             return 0
         else:
-            rawlabel = self.subject[:match_chars]
+            rawlabel = self.subject[startpos:startpos + match_chars]
 
         # colon:
         if (self.peek() == ':'):
@@ -834,10 +946,72 @@ class InlineParser:
         self.subject = block.string_content.strip()
         self.pos = 0
         self.delimiters = None
+        self.brackets = None
+        self.backtick_runs = None
         while (self.parseInline(block)):
             pass
         # allow raw string to be garbage collected
         block.string_content = None
         self.processEmphasis(None)
+        merge_text_nodes(block)
 
     parse = parseInlines
+
+
+def pack_inlines(block):
+    """
+    Return the inline children of block as a flat list, in document
+    order, of (type code, literal, destination, title, descendants)
+    tuples.
+    Unlike a tree of Nodes, this is cheap to pickle.
+    """
+    packed = []
+    # the index in packed of each container being walked
+    starts = []
+    for node, entering in block.walk():
+        if node is block:
+            continue
+        if entering:
+            starts.append(len(packed))
+            packed.append(None)
+            if node.type_code in CONTAINER_CODES:
+                continue
+        i = starts.pop()
+        packed[i] = (node.type_code, node.literal, node.destination,
+                     node.title, len(packed) - i - 1)
+    return packed
+
+
+def unpack_inlines(block, packed):
+    """Append the inlines packed by pack_inlines to block's children."""
+    parents = [(block, len(packed))]
+    for i, (code, literal, destination, title, descendants) in \
+            enumerate(packed):
+        while i >= parents[-1][1]:
+            parents.pop()
+        node = Node(NODE_TYPES[code], None)
+        node.literal = literal
+        node.destination = destination
+        node.title = title
+        parents[-1][0].append_child(node)
+        if descendants:
+            parents.append((node, i + 1 + descendants))
+
+
+def parse_inlines_batch(contents, refmap, options):
+    """
+    Parse each string in contents as the string content of a block.
+    Returns a list of (packed inlines, reference labels looked up)
+    pairs; this is what worker processes run for
+    Parser.process_inlines when the 'inline_workers' option is set.
+    """
+    parser = InlineParser(options)
+    parser.refmap = refmap
+    results = []
+    for content in contents:
+        block = Node('Paragraph', None)
+        block.string_content = content
+        parser.label_uses = {}
+        parser.parse(block)
+        results.append((pack_inlines(block), list(parser.label_uses)))
+    return results
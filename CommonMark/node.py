@@ -1,16 +1,88 @@
 from __future__ import unicode_literals
 
-import re
 
+# Node type codes.  Each Node has the code of its type in type_code,
+# which the parser and renderer dispatch on; node.t is the type's name.
+(DOCUMENT, BLOCK_QUOTE, LIST, ITEM, PARAGRAPH, HEADING, CODE_BLOCK,
+ HTML_BLOCK, THEMATIC_BREAK, CUSTOM_BLOCK, TEXT, SOFTBREAK, HARDBREAK,
+ EMPH, STRONG, LINK, IMAGE, CODE, HTML_INLINE, CUSTOM_INLINE) = range(20)
 
-reContainer = re.compile(
-    r'(Document|BlockQuote|List|Item|Paragraph|'
-    r'Heading|Emph|Strong|Link|Image|'
-    r'CustomInline|CustomBlock)')
+# The name of each node type, by code.  node_type_code adds other types.
+NODE_TYPES = [
+    'Document', 'BlockQuote', 'List', 'Item', 'Paragraph', 'Heading',
+    'CodeBlock', 'HtmlBlock', 'ThematicBreak', 'CustomBlock',
+    'Text', 'Softbreak', 'Hardbreak', 'Emph', 'Strong', 'Link', 'Image',
+    'Code', 'HtmlInline', 'CustomInline']
+
+NODE_TYPE_CODES = dict((t, code) for code, t in enumerate(NODE_TYPES))
+
+# The types whose children walkers descend into.  Sets rather than
+# frozensets, so that add_container_type can add custom types.
+CONTAINER_TYPES = set([
+    'Document', 'BlockQuote', 'List', 'Item', 'Paragraph',
+    'Heading', 'Emph', 'Strong', 'Link', 'Image',
+    'CustomInline', 'CustomBlock'])
+
+CONTAINER_CODES = set(NODE_TYPE_CODES[t] for t in CONTAINER_TYPES)
+
+
+def node_type_code(t):
+    """Returns the code of node type t, giving it one if it is new."""
+    code = NODE_TYPE_CODES.get(t)
+    if code is None:
+        code = NODE_TYPE_CODES[t] = len(NODE_TYPES)
+        NODE_TYPES.append(t)
+    return code
+
+
+def add_container_type(t):
+    """Make nodes of type t containers, whose children are walked."""
+    CONTAINER_TYPES.add(t)
+    CONTAINER_CODES.add(node_type_code(t))
 
 
 def is_container(node):
-    return (re.match(reContainer, node.t) is not None)
+    return node.type_code in CONTAINER_CODES
+
+
+def text_content(node):
+    """
+    Returns the plain text of node: the literal text of its inlines,
+    code blocks and HTML blocks, and the raw text of Paragraphs and
+    Headings whose inlines have not been parsed (see the 'blocks_only'
+    and 'lazy' parser options), with a newline after each block.
+    """
+    root = node
+    parts = []
+    while True:
+        t = node.type_code
+        if (t == PARAGRAPH or t == HEADING) and \
+                node.string_content is not None:
+            # not parsed into inlines; don't force lazy blocks to be
+            parts.append(node.string_content.strip())
+            parts.append('\n')
+        elif t == CODE_BLOCK or t == HTML_BLOCK:
+            parts.append(node.literal)
+            if not node.literal.endswith('\n'):
+                parts.append('\n')
+        elif t == SOFTBREAK or t == HARDBREAK:
+            parts.append('\n')
+        elif node.literal is not None:
+            parts.append(node.literal)
+        else:
+            child = node.first_child
+            if child is not None:
+                node = child
+                continue
+            if t == PARAGRAPH or t == HEADING:
+                parts.append('\n')
+        while node is not root and node.nxt is None:
+            node = node.parent
+            if node.type_code == PARAGRAPH or node.type_code == HEADING:
+                parts.append('\n')
+        if node is root:
+            return ''.join(parts)
+        node = node.nxt
 
 
 class NodeWalker:
@@ -27,16 +99,14 @@ class NodeWalker:
         if cur is None:
             return None
 
-        container = is_container(cur)
-
-        if entering and container:
+        if entering and cur.type_code in CONTAINER_CODES:
             if cur.first_child:
                 self.current = cur.first_child
                 self.entering = True
             else:
                 # stay on node but exit
                 self.entering = False
-        elif cur == self.root:
+        elif cur is self.root:
             self.current = None
         elif cur.nxt is None:
             self.current = cur.parent
@@ -55,9 +125,37 @@ class NodeWalker:
         self.entering = (entering is True)
 
 
-class Node:
+class ListData(object):
+    """
+    The list marker of a List or Item node: type is 'Bullet' (with
+    bullet_char) or 'Ordered' (with start and delimiter), padding the
+    width of the marker and the spaces after it, and marker_offset the
+    indentation of the marker.
+    """
+    __slots__ = ('type', 'tight', 'bullet_char', 'start', 'delimiter',
+                 'padding', 'marker_offset')
+
+    def __init__(self, type=None, tight=True, bullet_char=None, start=None,
+                 delimiter=None, padding=None, marker_offset=None):
+        self.type = type
+        self.tight = tight  # lists are tight by default
+        self.bullet_char = bullet_char
+        self.start = start
+        self.delimiter = delimiter
+        self.padding = padding
+        self.marker_offset = marker_offset
+
+
+class Node(object):
+    __slots__ = ('type_code', 'parent', 'first_child', 'last_child', 'prv',
+                 'nxt', 'sourcepos', 'last_line_blank', 'is_open',
+                 'string_content', 'content_lines', 'literal', 'list_data',
+                 'info', 'destination', 'title', 'is_fenced', 'fence_char',
+                 'fence_length', 'fence_offset', 'level', 'html_block_type',
+                 'on_enter', 'on_exit')
+
     def __init__(self, node_type, sourcepos):
-        self.t = node_type
+        self.type_code = node_type_code(node_type)
         self.parent = None
         self.first_child = None
         self.last_child = None
@@ -67,8 +165,9 @@ class Node:
         self.last_line_blank = False
         self.is_open = True
         self.string_content = None
+        self.content_lines = None
         self.literal = None
-        self.list_data = {}
+        self.list_data = None
         self.info = None
         self.destination = None
         self.title = None
@@ -77,18 +176,30 @@ class Node:
         self.fence_length = 0
         self.fence_offset = None
         self.level = None
+        self.html_block_type = None
         self.on_enter = None
         self.on_exit = None
 
+    @property
+    def t(self):
+        """The name of the node's type, such as 'Paragraph'."""
+        return NODE_TYPES[self.type_code]
+
+    @t.setter
+    def t(self, node_type):
+        self.type_code = node_type_code(node_type)
+
     def __repr__(self):
         return "Node {} [{}]".format(self.t, self.literal)
 
     def pretty(self):
         from pprint import pprint
-        pprint(self.__dict__)
+        data = dict((attr, getattr(self, attr)) for attr in self.__slots__)
+        data['t'] = self.t
+        pprint(data)
 
     def is_container(self):
-        return is_container(self)
+        return self.type_code in CONTAINER_CODES
 
     def append_child(self, child):
         child.unlink()
@@ -151,3 +262,47 @@ class Node:
 
     def walker(self):
         return NodeWalker(self)
+
+    def walk(self):
+        """
+        Yields (node, entering) for each step of a walk over this node
+        and its descendants, in the same order as walker(): containers
+        once entering and once leaving, other nodes once, entering.
+        """
+        node = self
+        while True:
+            if node.type_code in CONTAINER_CODES:
+                child = node.first_child
+                yield node, True
+                if child is not None:
+                    node = child
+                    continue
+                yield node, False
+            else:
+                yield node, True
+            while node is not self and node.nxt is None:
+                node = node.parent
+                yield node, False
+            if node is self:
+                return
+            node = node.nxt
+
+    def leaves(self):
+        """
+        Yields each node under this one that has no children, in
+        document order.  Before inlines are parsed, these include the
+        Paragraphs and Headings; a node is not descended into if
+        children are added to it while it is being visited.
+        """
+        node = self
+        while True:
+            child = node.first_child
+            if child is not None:
+                node = child
+                continue
+            yield node
+            while node is not self and node.nxt is None:
+                node = node.parent
+            if node is self:
+                return
+            node = node.nxt
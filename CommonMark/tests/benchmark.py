@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Benchmarks for the CommonMark parser and renderer.
+
+Run from the repository root, either all benchmarks or just the
+named ones:
+
+    python CommonMark/tests/benchmark.py
+    python CommonMark/tests/benchmark.py lines
+"""
+from __future__ import division, print_function, unicode_literals
+import argparse
+import gc
+import timeit
+import CommonMark
+
+BENCHMARKS = []
+
+
+def benchmark(f):
+    BENCHMARKS.append(f)
+    return f
+
+
+def best_of(f, repeat=3):
+    """Return the fastest of repeat runs of f, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        f()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def report(name, size, unit, seconds):
+    print('{0:<32} {1:>9} {2:<6} {3:>9.4f}s {4:>10.2f}us/{5}'.format(
+        name, size, unit, seconds, seconds * 1e6 / size, unit))
+
+
+def report_memory(name, size, unit, nbytes):
+    print('{0:<32} {1:>9} {2:<6} {3:>9.2f}MB {4:>9.1f}B/{5}'.format(
+        name, size, unit, nbytes / 1e6, nbytes / size, unit))
+
+
+@benchmark
+def lines():
+    """Per-line cost of the block phase on a mixed document."""
+    sample = (
+        '# Heading\n'
+        '\n'
+        'A paragraph of *text* with `code` and a [link](/url).\n'
+        'It runs over two lines.\n'
+        '\n'
+        '> quoted\n'
+        '> text\n'
+        '\n'
+        '- item one\n'
+        '- item two\n'
+        '  continued\n'
+        '\n'
+        '```\n'
+        'code\n'
+        '```\n'
+        '\n')
+    for n in (100, 1000):
+        text = sample * n
+        count = text.count('\n')
+        parser = CommonMark.Parser()
+        seconds = best_of(lambda: parser.parse(text))
+        report('lines', count, 'line', seconds)
+
+
+@benchmark
+def code_block():
+    """Parse time of single fenced code blocks as they grow."""
+    for n in (1000, 10000, 50000):
+        text = '```\n' + 'x = 1\n' * n + '```\n'
+        parser = CommonMark.Parser()
+        seconds = best_of(lambda: parser.parse(text))
+        report('code_block', n, 'line', seconds)
+
+
+@benchmark
+def block_starts():
+    """Per-line cost of documents dominated by one kind of block."""
+    samples = [
+        ('paragraphs', 'Just some plain text on a line.\n'),
+        ('lists', '- item\n  - nested item\n1. ordered item\n'),
+        ('quotes', '> quoted\n> > nested quote\n>\n'),
+        ('headings', '# Heading\n\n## Another heading ##\n'),
+        ('breaks', '***\n- - -\n'),
+        ('html', '<div>\n</div>\n\n'),
+        ('long lines', '- ' + 'word ' * 50 + '\n# ' + 'word ' * 50 + '\n'),
+    ]
+    for name, sample in samples:
+        text = sample * (5000 // sample.count('\n'))
+        parser = CommonMark.Parser()
+        seconds = best_of(lambda: parser.parse(text))
+        report('block_starts ' + name, text.count('\n'), 'line', seconds)
+
+
+@benchmark
+def long_paragraph():
+    """Inline parse time of single paragraphs as they grow."""
+    sample = 'Plain text with *emphasis*, `code`, &amp; and <b>html</b>.\n'
+    for n in (1000, 4000, 16000):
+        text = sample * n
+        parser = CommonMark.Parser()
+        seconds = best_of(lambda: parser.parse(text))
+        report('long_paragraph', len(text), 'byte', seconds)
+
+
+@benchmark
+def emphasis():
+    """Inline parse time of emphasis-heavy text."""
+    sample = ('*One* **two** _three_ __four__ ***five*** *six **seven** '
+              'eight* _nine_*ten*.\n\n')
+    text = sample * 2000
+    parser = CommonMark.Parser()
+    seconds = best_of(lambda: parser.parse(text))
+    report('emphasis', len(text), 'byte', seconds)
+
+
+@benchmark
+def brackets():
+    """Inline parse time of paragraphs full of links and stray brackets."""
+    samples = [
+        ('links', lambda n: '[a](/b) ' * n),
+        ('openers', lambda n: '[a ' * n),
+        ('openers+links', lambda n: '[a ' * n + '[a](/b) ' * n),
+        ('nested', lambda n: '[' * n + 'a' + ']' * n),
+    ]
+    for n in (1000, 10000):
+        for name, sample in samples:
+            text = sample(n)
+            parser = CommonMark.Parser()
+            seconds = best_of(lambda: parser.parse(text))
+            report('brackets ' + name, n, 'link', seconds)
+
+
+@benchmark
+def render():
+    """Render time of a parsed document."""
+    sample = (
+        "Plain prose, with punctuation! Some & entities &amp; escapes \\*\n"
+        "and [brackets] that aren't links, *emphasis* and `code`.\n"
+        '\n')
+    text = sample * 2000
+    doc = CommonMark.Parser().parse(text)
+    renderer = CommonMark.HtmlRenderer()
+    seconds = best_of(lambda: renderer.render(doc))
+    report('render', len(text), 'byte', seconds)
+
+
+@benchmark
+def smart():
+    """Inline parse time of ordinary prose, with and without smart."""
+    sample = (
+        'Ordinary prose, as most documents have it! Sentences end, and\n'
+        '*commas*, `colons`: semicolons; & the odd dash - break them up.\n'
+        '\n')
+    text = sample * 2000
+    for options in ({}, {'smart': True}):
+        parser = CommonMark.Parser(options)
+        seconds = best_of(lambda: parser.parse(text))
+        report('smart ' + str(bool(options)), len(text), 'byte', seconds)
+
+
+@benchmark
+def entities():
+    """Parse time of entity-heavy text, such as scraped HTML."""
+    sample = (
+        'Caf&eacute; &amp; cr&egrave;me &mdash; &ldquo;quoted&rdquo;&nbsp;'
+        '&#169; &#x2014; [link](/a?b=1&amp;c=&#50; "&quot;title&quot;")\n'
+        '\n')
+    text = sample * 2000
+    parser = CommonMark.Parser()
+    seconds = best_of(lambda: parser.parse(text))
+    report('entities', len(text), 'byte', seconds)
+
+
+@benchmark
+def angle_brackets():
+    """Inline parse time of text with raw HTML and stray '<'s."""
+    sample = (
+        'if a < b and c <= d then <em class="x">e</em> <!-- note --> '
+        '<http://example.com> <me@example.com> 1 << 2 <- <3\n'
+        '\n')
+    text = sample * 2000
+    parser = CommonMark.Parser()
+    seconds = best_of(lambda: parser.parse(text))
+    report('angle_brackets', len(text), 'byte', seconds)
+
+
+@benchmark
+def reparse():
+    """
+    Latency of one-character edits, reparsed incrementally: one that
+    keeps the line count, one that adds a line (so every later block
+    is moved), and one inside a single large list (which is parsed
+    again whole).
+    """
+    sample = (
+        '## Section\n'
+        '\n'
+        'A paragraph of *text* with `code` and a [link][ref].\n'
+        '\n'
+        '- item\n'
+        '- item\n'
+        '\n')
+    for n in (100, 1000, 5000):
+        text = sample * n + '[ref]: /url\n'
+        parser = CommonMark.Parser()
+        seconds = best_of(lambda: parser.parse(text))
+        report('reparse full', len(text), 'byte', seconds)
+
+        pos = text.index('text', len(text) // 2)
+        for name, new in (('edit', 'T'), ('new line', '\n')):
+            edited = text[:pos] + new + text[pos + 1:]
+            doc = parser.parse(text)
+            parser.reparse(doc, text, edited, pos, pos + 1)
+            seconds = best_of(lambda: (
+                parser.reparse(doc, edited, text, pos, pos + 1),
+                parser.reparse(doc, text, edited, pos, pos + 1))) / 2
+            report('reparse ' + name, len(text), 'byte', seconds)
+
+    for n in (1000, 10000, 60000):
+        text = '- item *text*\n' * n
+        parser = CommonMark.Parser()
+        seconds = best_of(lambda: parser.parse(text))
+        report('reparse list full', len(text), 'byte', seconds)
+
+        pos = text.index('text', len(text) // 2)
+        edited = text[:pos] + 'T' + text[pos + 1:]
+        doc = parser.parse(text)
+        parser.reparse(doc, text, edited, pos, pos + 1)
+        seconds = best_of(lambda: (
+            parser.reparse(doc, edited, text, pos, pos + 1),
+            parser.reparse(doc, text, edited, pos, pos + 1))) / 2
+        report('reparse list edit', len(text), 'byte', seconds)
+
+
+@benchmark
+def inline_workers():
+    """Parse time of an inline-heavy document with worker processes."""
+    sample = (
+        'Some **strong _and_ emphasised** text with `code`, <b>html</b>,\n'
+        '![an image](/img "title") and [a [nested] link](/url &amp; more).\n'
+        '\n')
+    text = sample * 4000
+    for workers in (None, 2, 4):
+        parser = CommonMark.Parser({'inline_workers': workers})
+        seconds = best_of(lambda: parser.parse(text))
+        report('inline_workers ' + str(workers), len(text), 'byte', seconds)
+
+
+@benchmark
+def lazy():
+    """Time to parse a document and read its headings, lazily or not."""
+    sample = (
+        '## Section *title*\n'
+        '\n'
+        'Some **strong _and_ emphasised** text with `code`, <b>html</b>,\n'
+        '![an image](/img "title") and [a [nested] link](/url).\n'
+        '\n')
+    text = sample * 2000
+
+    def headings(options):
+        block = CommonMark.Parser(options).parse(text).first_child
+        while block:
+            if block.t == 'Heading':
+                block.first_child
+            block = block.nxt
+    for options in ({}, {'lazy': True}):
+        seconds = best_of(lambda: headings(options))
+        report('lazy ' + str(bool(options)), len(text), 'byte', seconds)
+
+
+@benchmark
+def blocks_only():
+    """Time to extract the text of a document, with and without inlines."""
+    sample = (
+        '## Section *title*\n'
+        '\n'
+        'Some **strong _and_ emphasised** text with `code`, <b>html</b>,\n'
+        '![an image](/img "title") and [a [nested] link](/url).\n'
+        '\n')
+    text = sample * 2000
+    for options in ({}, {'blocks_only': True}):
+        parser = CommonMark.Parser(options)
+        seconds = best_of(
+            lambda: CommonMark.text_content(parser.parse(text)))
+        report('blocks_only ' + str(bool(options)), len(text), 'byte',
+               seconds)
+
+
+@benchmark
+def memory():
+    """
+    Memory per node of a parsed document, as Nodes or copied into an
+    ArrayTree: the peak while parsing (and copying), and what is held
+    afterwards.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('memory: needs tracemalloc (Python 3.4+)')
+        return
+    sample = (
+        '## Section *title*\n'
+        '\n'
+        'Some **strong _and_ emphasised** text with `code`, <b>html</b>,\n'
+        '![an image](/img "title") and [a [nested] link](/url).\n'
+        '\n'
+        '- item\n'
+        '- item\n'
+        '\n')
+    text = sample * 2000
+    for name, parse in (
+            ('Node', lambda: CommonMark.Parser().parse(text)),
+            ('ArrayTree', lambda: CommonMark.ArrayTree(
+                CommonMark.Parser().parse(text)))):
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        doc = parse()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        count = sum(entering for node, entering in doc.walk()) \
+            if name == 'Node' else len(doc)
+        report_memory('memory peak ' + name, count, 'node', peak - before)
+        report_memory(
+            'memory retained ' + name, count, 'node', retained - before)
+        del doc
+
+
+@benchmark
+def walker():
+    """Walk time of a large tree, visiting every node twice."""
+    doc = CommonMark.node.Node('Document', [[1, 1], [0, 0]])
+    for _ in range(1000):
+        para = CommonMark.node.Node('Paragraph', None)
+        doc.append_child(para)
+        for _ in range(333):
+            emph = CommonMark.node.Node('Emph', None)
+            emph.append_child(CommonMark.node.Node('Text', None))
+            para.append_child(emph)
+            para.append_child(CommonMark.node.Node('Softbreak', None))
+
+    def walker():
+        walker = doc.walker()
+        while walker.nxt():
+            pass
+
+    def walk():
+        for node, entering in doc.walk():
+            pass
+
+    def leaves():
+        for node in doc.leaves():
+            pass
+    count = 1 + 1000 * (1 + 333 * 3)
+    for f in (walker, walk, leaves):
+        seconds = best_of(f)
+        report('walker ' + f.__name__, count, 'node', seconds)
+
+
+if __name__ == '__main__':
+    names = [f.__name__ for f in BENCHMARKS]
+    argparser = argparse.ArgumentParser(
+        description='Run CommonMark-py benchmarks.')
+    argparser.add_argument(
+        'benchmarks', nargs='*',
+        help='Benchmarks to run (default: all of ' + ', '.join(names) + ')')
+    args = argparser.parse_args()
+    for name in args.benchmarks:
+        if name not in names:
+            argparser.error('unknown benchmark: ' + name)
+    for f in BENCHMARKS:
+        if not args.benchmarks or f.__name__ in args.benchmarks:
+            f()
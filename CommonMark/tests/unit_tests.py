@@ -1,13 +1,48 @@
 from __future__ import unicode_literals
 
+import io
+import json
+import random
+import tempfile
+import timeit
 import unittest
+try:
+    import concurrent.futures
+except ImportError:
+    concurrent = None
 import CommonMark
+from CommonMark import blocks
+from CommonMark import common
+from CommonMark import node as node_module
+from CommonMark.arraytree import ArrayTree
 from CommonMark.blocks import Parser
 from CommonMark.html import HtmlRenderer
 from CommonMark.inlines import InlineParser
 from CommonMark.node import NodeWalker, Node
 
 
+def restore_node_types(test):
+    """Undo, when test ends, any node types, block handlers and
+    container types that it registers."""
+    saved = (list(node_module.NODE_TYPES),
+             dict(node_module.NODE_TYPE_CODES),
+             set(node_module.CONTAINER_TYPES),
+             set(node_module.CONTAINER_CODES),
+             dict(blocks.block_handlers))
+
+    def restore():
+        for current, old in zip(
+                (node_module.NODE_TYPES, node_module.NODE_TYPE_CODES,
+                 node_module.CONTAINER_TYPES, node_module.CONTAINER_CODES,
+                 blocks.block_handlers), saved):
+            if isinstance(current, list):
+                current[:] = old
+            else:
+                current.clear()
+                current.update(old)
+    test.addCleanup(restore)
+
+
 class TestCommonmark(unittest.TestCase):
     def test_output(self):
         s = CommonMark.commonmark('*hello!*')
@@ -21,6 +56,32 @@ class TestCommonmark(unittest.TestCase):
         CommonMark.commonmark('# unicode: \u2020')
         CommonMark.commonmark('```\n# unicode: \u2020\n```')
 
+    def test_entities(self):
+        s = CommonMark.commonmark(
+            '&eacute; &AMP; &#169; &#X2014; &#0; &#xD800; &#128; '
+            '&copycat; &nosuch;')
+        self.assertEqual(
+            s, '<p>\xe9 &amp; \xa9 \u2014 \ufffd \ufffd \u20ac '
+            '&amp;copycat; &amp;nosuch;</p>\n')
+
+    def test_raw_html(self):
+        s = CommonMark.commonmark(
+            'a <![cdata[ x ]]> <!doctype html> <Em class="x"> b')
+        self.assertEqual(
+            s, '<p>a <![cdata[ x ]]> <!doctype html> <Em class="x"> b</p>\n')
+        self.assertIsNotNone(common.reHtmlTag.match('<Em class="x"> b'))
+        self.assertIsNone(common.reHtmlTag.search('a <Em class="x">'))
+
+    def test_json(self):
+        doc = Parser().parse('3) item\n')
+        self.assertEqual(json.loads(CommonMark.ASTtoJSON(doc.first_child)), {
+            't': 'List', 'open': False, 'sourcepos': [[1, 1], [1, 7]],
+            'last_line_blank': False, 'is_fenced': False, 'fence_length': 0,
+            'list_data': {
+                'type': 'Ordered', 'tight': True, 'bullet_char': None,
+                'start': 3, 'delimiter': ')', 'padding': 3,
+                'marker_offset': 0}})
+
 
 class TestHtmlRenderer(unittest.TestCase):
     def test_init(self):
@@ -31,17 +92,135 @@ class TestInlineParser(unittest.TestCase):
     def test_init(self):
         InlineParser()
 
+    def test_emphasis_linear(self):
+        # About 100k delimiters each; quadratic behaviour in
+        # processEmphasis would take many minutes here.
+        for source, options in [
+                ('*a **b ' * 33333, {}),
+                ('*a_ ' * 50000, {}),
+                ("'a " + "b' " * 100000, {'smart': True}),
+                ('"a ' + 'b" ' * 100000, {'smart': True})]:
+            start = timeit.default_timer()
+            Parser(options).parse(source)
+            self.assertLess(timeit.default_timer() - start, 30)
+
+    def test_backticks_linear(self):
+        # Runs of 1 to 4999 backticks, none of which has a closer;
+        # searching the rest of the paragraph for each closer would take
+        # over a minute here.
+        source = ''.join('`' * i + 'a' for i in range(1, 5000))
+        start = timeit.default_timer()
+        doc = Parser().parse(source)
+        self.assertLess(timeit.default_timer() - start, 30)
+        self.assertEqual(doc.first_child.first_child.literal, source)
+        doc = Parser().parse('`a` ' * 25000)
+        self.assertEqual(doc.first_child.last_child.t, 'Code')
+        doc = Parser().parse('\\``a` ``b`` `c')
+        self.assertEqual(HtmlRenderer().render(doc),
+                         '<p>`<code>a</code> <code>b</code> `c</p>\n')
+
+    def test_smart_punctuation(self):
+        doc = Parser({'smart': True}).parse(
+            '"Don\'t" -- a... b.... c---d ----- e-f - g.\n')
+        self.assertEqual(
+            doc.first_child.first_child.literal,
+            '\u201cDon\u2019t\u201d \u2013 a\u2026 b\u2026. '
+            'c\u2014d \u2014\u2013 e-f - g.')
+
+    def test_merge_text_nodes(self):
+        doc = Parser().parse('a & b! \\* c [d *e ** f* g\n')
+        paragraph = doc.first_child
+        self.assertEqual(
+            [(node.t, node.literal) for node in (
+                paragraph.first_child, paragraph.first_child.nxt,
+                paragraph.last_child)],
+            [('Text', 'a & b! * c [d '), ('Emph', None), ('Text', ' g')])
+        self.assertEqual(paragraph.first_child.nxt.first_child.literal,
+                         'e ** f')
+
 
 class TestNode(unittest.TestCase):
     def test_doc_node(self):
         Node('Document', [[1, 1], [0, 0]])
 
+    def test_type_code(self):
+        node = Node('Paragraph', None)
+        self.assertEqual(node.type_code, node_module.PARAGRAPH)
+        node.t = 'Heading'
+        self.assertEqual(node.type_code, node_module.HEADING)
+        self.assertEqual(node.t, 'Heading')
+        custom = Node('Custom', None)
+        self.assertEqual(custom.t, 'Custom')
+        self.assertEqual(
+            node_module.NODE_TYPES[custom.type_code], 'Custom')
+
+    def test_is_container(self):
+        doc = Parser().parse('> *a* `b`\n\n***\n')
+        quote = doc.first_child
+        para = quote.first_child
+        self.assertTrue(doc.is_container())
+        self.assertTrue(quote.is_container())
+        self.assertTrue(para.first_child.is_container())
+        self.assertFalse(para.last_child.is_container())
+        self.assertFalse(quote.nxt.is_container())
+
 
 class TestNodeWalker(unittest.TestCase):
     def test_node_walker(self):
         node = Node('Document', [[1, 1], [0, 0]])
         NodeWalker(node)
 
+    def test_walk(self):
+        doc = Parser().parse('- *a* b\n- \n\n***\n')
+        events = []
+        walker = doc.walker()
+        event = walker.nxt()
+        while event is not None:
+            events.append((event['node'], event['entering']))
+            event = walker.nxt()
+        self.assertEqual(list(doc.walk()), events)
+        self.assertEqual(
+            [(node.t, entering) for node, entering in doc.first_child.walk()],
+            [('List', True), ('Item', True), ('Paragraph', True),
+             ('Emph', True), ('Text', True), ('Emph', False), ('Text', True),
+             ('Paragraph', False), ('Item', False), ('Item', True),
+             ('Item', False), ('List', False)])
+        self.assertEqual(
+            [node.t for node in doc.leaves()],
+            ['Text', 'Text', 'Item', 'ThematicBreak'])
+
+
+class TestArrayTree(unittest.TestCase):
+    def test_array_tree(self):
+        text = ('# *Title*\n\n3) a [link](/url "t") `code`\n4) b\n\n'
+                '    code\n\n> <div>\n> </div>\n')
+        doc = Parser().parse(text)
+        tree = ArrayTree(doc)
+        self.assertEqual(
+            [(node.t, entering, node.sourcepos, node.literal)
+             for node, entering in tree.root.walk()],
+            [(node.t, entering, node.sourcepos, node.literal)
+             for node, entering in doc.walk()])
+        self.assertEqual(
+            len(tree), sum(entering for node, entering in doc.walk()))
+        self.assertEqual(HtmlRenderer().render(tree.root),
+                         HtmlRenderer().render(doc))
+        self.assertEqual(CommonMark.ASTtoJSON(tree.root),
+                         CommonMark.ASTtoJSON(doc))
+        item = tree.root.first_child.nxt.last_child
+        self.assertEqual(item.t, 'Item')
+        self.assertEqual(item.list_data.start, 4)
+        self.assertEqual(item.prv, tree.root.first_child.nxt.first_child)
+        self.assertEqual(item.parent.parent, tree.root)
+        self.assertIsNone(item.nxt)
+        # more node types than fit in a byte
+        restore_node_types(self)
+        doc = Node('Document', None)
+        for i in range(300):
+            doc.append_child(Node('ArrayTreeType%d' % i, None))
+        tree = ArrayTree(doc)
+        self.assertEqual(tree.root.last_child.t, 'ArrayTreeType299')
+
 
 class TestParser(unittest.TestCase):
     def setUp(self):
@@ -52,3 +231,293 @@ class TestParser(unittest.TestCase):
 
     def test_unicode(self):
         self.parser.parse('* unicode: \u2020')
+
+    def test_register_block_type(self):
+        restore_node_types(self)
+        finalized = []
+
+        class RecordingParagraph(blocks.Paragraph):
+            @staticmethod
+            def finalize(parser=None, block=None):
+                finalized.append(block)
+                blocks.Paragraph.finalize(parser, block)
+
+        previous = blocks.register_block_type('Paragraph', RecordingParagraph)
+        try:
+            self.parser.parse('one\n\ntwo\n')
+        finally:
+            blocks.register_block_type('Paragraph', previous)
+        self.assertEqual(len(finalized), 2)
+        self.assertIs(blocks.block_handlers['Paragraph'], blocks.Paragraph)
+        # assigning into block_handlers works too
+        blocks.block_handlers['Paragraph'] = RecordingParagraph
+        try:
+            self.parser.parse('three\n')
+        finally:
+            blocks.block_handlers['Paragraph'] = previous
+        self.assertEqual(len(finalized), 3)
+
+        blocks.register_block_type('Aside', blocks.BlockQuote, container=True)
+        aside = Node('Aside', None)
+        aside.append_child(Node('Paragraph', None))
+        self.assertTrue(aside.is_container())
+        self.assertEqual(
+            [(node.t, entering) for node, entering in aside.walk()],
+            [('Aside', True), ('Paragraph', True),
+             ('Paragraph', False), ('Aside', False)])
+
+    def test_long_code_block(self):
+        body = ''.join('line %d\n' % i for i in range(5000))
+        doc = self.parser.parse('```\n' + body + '```\n')
+        self.assertEqual(doc.first_child.literal, body)
+        self.assertIsNone(doc.first_child.content_lines)
+
+    def test_block_start_dispatch_order(self):
+        methods = blocks.BlockStarts.METHODS
+        for names in blocks.BlockStarts.DISPATCH.values():
+            self.assertEqual(names, sorted(names, key=methods.index))
+        self.assertEqual(
+            self.parser.parse('-  a\n\n        b\n---\n').first_child.t,
+            'List')
+
+    def test_feed(self):
+        renderer = HtmlRenderer()
+        sources = [
+            '', '\n', 'a', 'a\r', 'a\r\n', '\r\r\n',
+            '# Title\r\n\r\n> quote\rlazy\n\n```\ncode\r\n```\n',
+            '- one\n- two\n\n  three *emph*\n[x]: /url\n\n[x]',
+        ]
+        for source in sources:
+            expected = renderer.render(self.parser.parse(source))
+            for size in (1, 2, 3, 7):
+                for i in range(0, len(source), size):
+                    self.parser.feed(source[i:i + size])
+                doc = self.parser.finish()
+                self.assertEqual(renderer.render(doc), expected)
+                self.assertEqual(
+                    doc.sourcepos, self.parser.parse(source).sourcepos)
+
+    def test_feed_long_line(self):
+        # One 2 MB line in 4-byte chunks; rebuilding the partial line
+        # on each call would take minutes here.
+        start = timeit.default_timer()
+        for i in range(500000):
+            self.parser.feed('abc ')
+        self.parser.feed('\r')
+        self.parser.feed('\nx')
+        doc = self.parser.finish()
+        self.assertLess(timeit.default_timer() - start, 30)
+        self.assertEqual(len(doc.first_child.first_child.literal),
+                         2000000 - 1)
+        self.assertEqual(doc.first_child.last_child.literal, 'x')
+
+    def test_parse_lines(self):
+        renderer = HtmlRenderer()
+        source = '# \u2020\r\n\r\n- a\n- b\r> c\nlazy'
+        expected = renderer.render(self.parser.parse(source))
+        lines = io.StringIO(source, newline='').readlines()
+        self.assertEqual(
+            renderer.render(self.parser.parse_lines(lines)), expected)
+        self.assertEqual(
+            renderer.render(self.parser.parse_lines(list(source))), expected)
+        self.assertEqual(
+            renderer.render(self.parser.parse_lines(['a\n', '', 'b\n'])),
+            '<p>a\nb</p>\n')
+        self.assertEqual(
+            renderer.render(self.parser.parse_lines(
+                ['', '# he', '', 'ading\n', 'a', '\n', '', 'b\n', ''])),
+            '<h1>heading</h1>\n<p>a\nb</p>\n')
+
+    def test_parse_file(self):
+        renderer = HtmlRenderer()
+        source = '# \u2020\r\n\r\n- a\n- b\n\n```\ncode\n```\n'
+        expected = renderer.render(self.parser.parse(source))
+        with tempfile.TemporaryFile() as fp:
+            fp.write(source.encode('utf-8'))
+            fp.seek(0)
+            doc = self.parser.parse_file(fp)
+            self.assertEqual(renderer.render(doc), expected)
+            fp.seek(0)
+            doc = self.parser.parse_file(fp, use_mmap=True)
+            self.assertEqual(renderer.render(doc), expected)
+        with tempfile.TemporaryFile() as fp:
+            doc = self.parser.parse_file(fp, use_mmap=True)
+            self.assertEqual(renderer.render(doc), '')
+
+    def test_reparse(self):
+        renderer = HtmlRenderer()
+        source = (
+            '# Title\n\nSome [text][a].\n\n- one\n- two\n\n'
+            '> quote\n\n[a]: /first\n\n```\ncode\n```\n\nlast [a]\n')
+        edits = [
+            ('Some', 'More'),          # inside one paragraph
+            ('- two\n', '- two\n- three\n'),  # adds a line
+            ('```\ncode\n```', '```\ncode'),  # fence left open
+            ('```\ncode', '```\ncode\n```'),
+            ('/first', '/second'),     # changes a reference
+            ('[a]: /second\n\n', ''),  # removes it
+            ('# Title\n\n', ''),
+        ]
+        doc = self.parser.parse(source)
+        for old, new in edits:
+            start = source.index(old)
+            new_source = source[:start] + new + source[start + len(old):]
+            last = doc.last_child
+            doc = self.parser.reparse(
+                doc, source, new_source, start, start + len(old))
+            source = new_source
+            expected = Parser().parse(source)
+            self.assertEqual(renderer.render(doc), renderer.render(expected))
+            self.assertEqual(doc.sourcepos, expected.sourcepos)
+            self.assertEqual(doc.last_child.sourcepos,
+                             expected.last_child.sourcepos)
+            if old == 'Some':
+                self.assertIs(doc.last_child, last)
+
+    def test_reparse_deep_nesting(self):
+        # moving blocks nested deeper than the recursion limit
+        source = 'a\n\n' + '> ' * 1200 + 'x\n'
+        new_source = source[:1] + '\nb' + source[1:]
+        doc = self.parser.reparse(
+            self.parser.parse(source), source, new_source, 1, 1)
+        expected = Parser().parse(new_source)
+        self.assertEqual(HtmlRenderer().render(doc),
+                         HtmlRenderer().render(expected))
+        self.assertEqual(doc.last_child.sourcepos,
+                         expected.last_child.sourcepos)
+
+    def assertReparsed(self, parser, doc, source, new_source, start, end):
+        doc = parser.reparse(doc, source, new_source, start, end)
+        expected = Parser().parse(new_source)
+        self.assertEqual(HtmlRenderer().render(doc),
+                         HtmlRenderer().render(expected), repr(new_source))
+        self.assertEqual(
+            [node.sourcepos for node, entering in doc.walk()
+             if entering and node.sourcepos],
+            [node.sourcepos for node, entering in expected.walk()
+             if entering and node.sourcepos], repr(new_source))
+        return doc
+
+    def test_reparse_after_list(self):
+        # an indented list marker after a List starts a new list, but
+        # an indented code block at the start of a document
+        for source, start, end, new in [
+                ('*    a\n    - b\n\nc\n', 11, 12, 'd'),
+                ('-->\n# h\n1.   b\n\t- t\n b\n', 7, 12, ''),
+                # the second list uses a reference the edit changes
+                ('[x]: /u\n\n*    a\n    - [x]\n', 6, 7, 'v')]:
+            new_source = source[:start] + new + source[end:]
+            parser = Parser()
+            self.assertReparsed(parser, parser.parse(source),
+                                source, new_source, start, end)
+
+    def test_reparse_random(self):
+        # Random line edits and character edits, each checked against
+        # a fresh parse of the new text.
+        lines = ['- a', '* b', '1. c', '2) d', '    - e', '\t- f', '*    g',
+                 '1.   h', '    code', '  x', '', '', '> q', '# h',
+                 '[a]: /u', '[a]: /v', 'p [a]', '    [a]', '- [a]', '```',
+                 '<div>', '<!-- c -->', 'text', '---', '   - i']
+        rng = random.Random(0)
+        for _ in range(200):
+            source = '\n'.join(
+                rng.choice(lines) for _ in range(rng.randint(3, 25)))
+            parser = Parser()
+            doc = parser.parse(source)
+            for _ in range(5):
+                if rng.random() < 0.5:
+                    start = rng.choice([0] + [
+                        i + 1 for i, c in enumerate(source) if c == '\n'])
+                    end = source.find('\n', start) + 1 or len(source)
+                    if rng.random() < 0.5:
+                        end = start
+                    new = ''.join(rng.choice(lines) + '\n'
+                                  for _ in range(rng.randint(0, 2)))
+                else:
+                    start = rng.randint(0, len(source))
+                    end = min(start + rng.randint(0, 4), len(source))
+                    new = rng.choice(['', 'x', ' ', '\n', '    ', '- ', '\t'])
+                new_source = source[:start] + new + source[end:]
+                doc = self.assertReparsed(
+                    parser, doc, source, new_source, start, end)
+                source = new_source
+
+    @unittest.skipIf(concurrent is None, 'needs concurrent.futures')
+    def test_inline_workers(self):
+        renderer = HtmlRenderer()
+        source = (
+            '# *Title* with [ref]\n\n'
+            'Some **strong _and_ emphasised** text, `code`, <b>html</b>,\n'
+            '![image](/i "t") and [a [nested] link](/url).\n\n'
+            '- [ref] in a list\n\n[ref]: /ref\n') * 20
+        expected = renderer.render(self.parser.parse(source))
+        parser = Parser({'inline_workers': 2})
+        doc = parser.parse(source)
+        self.assertEqual(renderer.render(doc), expected)
+        self.assertEqual(len(parser.label_uses['[REF]']), 40)
+        # deeper nesting than the recursion limit
+        source = '*a ' * 1200 + 'b' + ' a*' * 1200
+        self.assertEqual(renderer.render(parser.parse(source)),
+                         renderer.render(self.parser.parse(source)))
+        # reparse parses the few blocks it touches without the pool
+        source = 'a *b*\n\n[x]: /x\n\nc [x]\n'
+        executor = concurrent.futures.ProcessPoolExecutor(1)
+        parser = Parser({'inline_workers': executor})
+        doc = parser.parse(source)
+        executor.shutdown()
+        new_source = source.replace('/x', '/y')
+        start = source.index('/x')
+        doc = parser.reparse(doc, source, new_source, start, start + 2)
+        self.assertEqual(renderer.render(doc),
+                         renderer.render(self.parser.parse(new_source)))
+
+    def test_lazy(self):
+        renderer = HtmlRenderer()
+        source = '# *Title*\n\nSome [text][a].\n\n[a]: /url\n'
+        expected = renderer.render(self.parser.parse(source))
+        doc = Parser({'lazy': True}).parse(source)
+        heading = doc.first_child
+        paragraph = heading.nxt
+        self.assertEqual(paragraph.string_content, 'Some [text][a].\n')
+        self.assertEqual(heading.first_child.t, 'Emph')
+        self.assertIs(type(heading), Node)
+        self.assertIsNone(heading.string_content)
+        self.assertEqual(paragraph.string_content, 'Some [text][a].\n')
+        self.assertEqual(renderer.render(doc), expected)
+        self.assertIs(type(paragraph), Node)
+
+    def test_lazy_reparse(self):
+        renderer = HtmlRenderer()
+        parser = Parser({'lazy': True})
+        source = 'see [x][a]\n\nmiddle\n\nmore\n\n[a]: /one\n'
+        doc = parser.parse(source)
+        for old, new in (('see', 'Now see'), ('/one', '/two')):
+            start = source.index(old)
+            new_source = source[:start] + new + source[start + len(old):]
+            doc = parser.reparse(
+                doc, source, new_source, start, start + len(old))
+            source = new_source
+            self.assertEqual(renderer.render(doc),
+                             renderer.render(Parser().parse(source)))
+
+    def test_blocks_only(self):
+        source = ('# *Title*\n\nSome [text][a].\n\n'
+                  '> - item\n\n    code\n\n[a]: /url\n')
+        doc = Parser({'blocks_only': True}).parse(source)
+        heading = doc.first_child
+        self.assertEqual(heading.t, 'Heading')
+        self.assertIsNone(heading.first_child)
+        self.assertEqual(heading.string_content, '*Title*')
+        self.assertEqual(heading.nxt.string_content, 'Some [text][a].\n')
+        self.assertEqual(CommonMark.text_content(doc),
+                         '*Title*\nSome [text][a].\nitem\ncode\n')
+        self.assertEqual(CommonMark.text_content(self.parser.parse(source)),
+                         'Title\nSome text.\nitem\ncode\n')
+        # deeper nesting than the recursion limit
+        self.assertEqual(
+            CommonMark.text_content(self.parser.parse('> ' * 1200 + 'x')),
+            'x\n')
+        self.assertEqual(
+            CommonMark.text_content(self.parser.parse(
+                '*a ' * 1200 + 'b' + ' a*' * 1200)),
+            'a ' * 1200 + 'b' + ' a' * 1200 + '\n')
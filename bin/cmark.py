@@ -26,11 +26,7 @@ args = parser.parse_args()
 parser = CommonMark.Parser()
 f = args.infile
 o = args.o
-lines = []
-for line in f:
-    lines.append(line)
-data = "".join(lines)
-ast = parser.parse(data)
+ast = parser.parse_file(f)
 if not args.a and not args.aj:
     renderer = CommonMark.HtmlRenderer()
     o.write(renderer.render(ast))